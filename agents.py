@@ -1,8 +1,16 @@
+import math
+import multiprocessing
 import random
+import threading
 import time
-from string import ascii_lowercase, index
 from sys import version_info, stdout
-from reversi import BLACK, WHITE, opponent
+from reversi import BLACK, WHITE, opponent, parse_move
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
+from search import SearchTimeout, TimeManager, Timed, untimed, GAME_PHASES, EVALUATOR_PHASES
+from endgame import EndgameSolver
+from ordering import MoveOrderer
+from patterns import PatternEvaluator
+from cache import PositionCache
 
 py3 = version_info[0] > 2
 
@@ -13,21 +21,104 @@ def read_some_input(txt):
         return raw_input(txt)
 
 class Agent:
+    # time move generation, make/undo and evaluation separately, slows
+    # the search down so it is off unless asked for
+    timing = False
+    # keep searching on the opponent's time, see ponder()
+    pondering = False
+    # a PositionCache for move lists and leaf scores, or None
+    cache = None
 
     def next_move(self, game, state, timeout):
         abstract
 
-    def legal_moves(self, game, state, max_player):
-        tmp = state["player"]
+    def opponent_moved(self, game, state, move):
+        """ The opponent played move in state.
+        """
+        pass
 
-        state["player"] = max_player
-        max_moves = game.legal_moves(state)
+    def ponder(self, game, state):
+        """ Our move was played and state is what the opponent faces.
+        """
+        pass
 
-        state["player"] = opponent(max_player)
-        min_moves = game.legal_moves(state)
+    def moves(self, game, state):
+        """ game.legal_moves, from the cache if the agent has one.
+        """
+        if self.cache is None:
+            return game.legal_moves(state)
+        return self.cache.moves(game, state)
+
+    def reset_stats(self):
+        self.nodes = 0
+        self.leaves = 0
+        self.depth_times = []
+        self.best_value = None
+        self.phase_times = {} if self.timing else None
+        self.cache_counts = (self.cache.hits, self.cache.misses) if self.cache is not None else None
+
+    def instrument(self, obj, phases):
+        """ obj, wrapped to time the phases if timing is on.
+        """
+        if self.phase_times is None:
+            return obj
+        return Timed(untimed(obj), phases, self.phase_times)
 
-        state["player"] = tmp
-        return max_moves, min_moves
+    def turn_stats(self):
+        """ Search statistics for the turn just played.
+        """
+        elapsed = time.time() - self.clock.started
+        depth = self.depth_times[-1][0] if self.depth_times else None
+        cache_hits = cache_misses = None
+        if self.cache_counts is not None:
+            cache_hits = self.cache.hits - self.cache_counts[0]
+            cache_misses = self.cache.misses - self.cache_counts[1]
+        return {
+            "nodes": self.nodes,
+            "leaves": self.leaves,
+            "time": elapsed,
+            "nps": self.nodes / elapsed if elapsed > 0 else 0.0,
+            "depth": depth,
+            # b such that b ** depth nodes were searched
+            "branching": self.nodes ** (1.0 / depth) if depth and self.nodes else None,
+            "value": self.best_value,
+            "depth_times": list(self.depth_times),
+            "phase_times": dict(self.phase_times) if self.phase_times is not None else None,
+            "workers": getattr(self, "workers", 1),
+            "cache_hits": cache_hits,
+            "cache_misses": cache_misses
+        }
+
+    def fixed_depth(self, game, state, moves):
+        """ One search to self.depth. If time runs out, the best
+            of the root moves searched so far.
+        """
+        self.best_move = None
+        try:
+            _, self.best_value = self.search_root(game, state, moves, self.depth)
+            self.depth_times.append((self.depth + 1, time.time() - self.clock.started))
+        except SearchTimeout:
+            pass
+        return self.best_move or moves[0]
+
+    def deepen(self, game, state, moves, max_depth=None):
+        """ Iterative deepening: search 1, 2, 3... plies until the
+            turn budget runs out (or after max_depth) and return the
+            best move of the last iteration that completed. Each
+            iteration tries the previous best move first.
+        """
+        best_move = moves[0]
+        last = game.empty_count(state) if max_depth is None else max_depth + 1
+        for depth in range(last):
+            try:
+                best_move, self.best_value = self.search_root(game, state, moves, depth)
+            except SearchTimeout:
+                break
+            self.depth_times.append((depth + 1, time.time() - self.clock.started))
+            moves = [best_move] + [move for move in moves if move != best_move]
+            if self.clock.soft_expired():
+                break
+        return best_move
 
 class RandomAgent(Agent):
 
@@ -38,18 +129,19 @@ class RandomAgent(Agent):
 class InteractiveAgent(Agent):
 
     def next_move(self, game, state, timeout):
-        """ Read 5d and convert to (5,4)
+        """ Read 5d and convert to (4,5)
         """
         while True:
             action = read_some_input('What is your move? \n')
             #On some computers prining is optimized away, this row forced the print
             stdout.flush()
-             # first char is row and is a number
-            if (action == "pass"):
-                return action
-            row = int(action[0])
-            col = index(ascii_lowercase, action[1].lower()) + 1
-            move = (col,row)
+            try:
+                move = parse_move(action.strip())
+            except (ValueError, IndexError):
+                print('{} is not a move, try 5d or pass'.format(action))
+                continue
+            if move == "pass":
+                return move
             if game.is_legal_move(state, move):
                 return move
             else:
@@ -59,63 +151,89 @@ class InteractiveAgent(Agent):
 class MinMaxAgent(Agent):
     """ A min-max searching agent.
     """
-    def __init__(self, depth):
+    def __init__(self, depth, iterative=False, game_time=None, cache=None):
         self.depth = depth
+        self.iterative = iterative
+        self.clock = TimeManager(game_time)
+        # pass one PositionCache to several agents to share it
+        self.cache = cache if cache is not None else PositionCache()
 
     def next_move(self, game, state, timeout):
         # Idea is to go search in tree successors(state)
         # and select move that leads to best outcome.
-        self.player = state["player"]
-        self.turn_timer = time.time() + timeout
+        self.player = state.player
+        self.turn_time = self.clock.start(game, state, timeout)
+        self.reset_stats()
+        game = self.instrument(game, GAME_PHASES)
+        state = game.copy_state(state)
         moves = game.legal_moves(state);
-        if not moves:
-            return "pass"
-        else:
-            values = dict()
-            for move in moves:
-                if time.time() >= self.turn_timer:
-                    break
-
-                temp_state = game.make_move(state, move)
-                value = self.min_val(game, temp_state, self.depth)
-                values[move] = value
-            return max(values, key=values.get)
+        try:
+            if not moves:
+                return "pass"
+            elif self.iterative:
+                return self.deepen(game, state, moves)
+            else:
+                return self.fixed_depth(game, state, moves)
+        finally:
+            self.stats = self.turn_stats()
+            self.clock.stop()
+
+    def search_root(self, game, state, moves, depth):
+        best_value = None
+        for move in moves:
+            if time.time() >= self.turn_time:
+                raise SearchTimeout()
+            record = game.apply(state, move)
+            value = self.min_val(game, state, depth)
+            game.undo(state, record)
+            if best_value is None or value > best_value:
+                best_value = value
+                self.best_move = move
+        return self.best_move, best_value
 
 
     def max_val(self, game, state, depth):
+        self.nodes += 1
         if depth == 0:
+            self.leaves += 1
             return self.heuristics(game, state)
         else:
-            moves = game.legal_moves(state);
+            moves = self.moves(game, state)
             if not moves:
+                self.leaves += 1
                 return self.heuristics(game, state)
             else:
                 depth -= 1
                 values = dict()
                 for move in moves:
-                    if time.time() >= self.turn_timer:
-                        break
-                    temp_state = game.make_move(state, move)
-                    value = self.min_val(game, temp_state, depth)
+                    if time.time() >= self.turn_time:
+                        raise SearchTimeout()
+                    record = game.apply(state, move)
+                    value = self.min_val(game, state, depth)
+                    game.undo(state, record)
                     values[move] = value
                 return values[max(values, key=values.get)]
 
 
     def min_val(self, game, state, depth):
+        self.nodes += 1
         if depth == 0:
+            self.leaves += 1
             return self.heuristics(game, state)
         else:
-            moves = game.legal_moves(state);
+            moves = self.moves(game, state)
             if not moves:
+                self.leaves += 1
                 return self.heuristics(game, state)
             else:
                 depth -= 1
                 values = dict()
                 for move in moves:
-                    if time.time() >= self.turn_timer:
-                        break
-                    temp_state = game.make_move(state, move)
-                    value = self.max_val(game, temp_state, depth)
+                    if time.time() >= self.turn_time:
+                        raise SearchTimeout()
+                    record = game.apply(state, move)
+                    value = self.max_val(game, state, depth)
+                    game.undo(state, record)
                     values[move] = value
                 return values[min(values, key=values.get)]
 
@@ -126,302 +244,612 @@ class MinMaxAgent(Agent):
 
 
 class AlphaBetaAgent(Agent):
-
-    def __init__(self, depth):
+    INFINITY = 100000
+    # half width of the root window around the last iteration's value
+    ASPIRATION = 25
+    # remember leaf scores in the position cache, see evaluate()
+    cache_scores = False
+
+    def __init__(self, depth, tt_size=16, iterative=False, game_time=None, workers=1, endgame=0,
+                 book=None, weights=None, cache=None):
         self.depth = depth
+        # pattern tables from patterns.load_weights, None for the defaults
+        self.weights = weights
+        self.patterns = None
+        self.evaluator = None
+        # an OpeningBook or None
+        self.book = book
+        # solve exactly with this many empty squares or fewer
+        self.endgame = endgame
+        self.iterative = iterative
+        self.clock = TimeManager(game_time)
+        # kept for the whole game, so later turns reuse earlier searches
+        self.table = TranspositionTable(tt_size)
+        self.tt_size = tt_size
+        # move lists and leaf scores, likewise, can be shared with other agents
+        self.cache = cache if cache is not None else PositionCache()
+        self.workers = workers
+        self.pool = None
+        # killers and history, also kept for the whole game
+        self.orderer = None
+        self.ponder_thread = None
+        self.ponder_move = None
+        self.ponder_hit = None
+        self.ponder_depth = None
 
     def next_move(self, game, state, timeout):
         # Very similar to minmax but do some magic with
         # inequalities so that we can prune states that
         # fail, or something...
 
-        v = -100000
-        a = -100000
-        b = 100000
-        ranking = dict()
-        self.prepare_ranking(ranking)
-        self.player = state["player"]
-        self.turn_time = time.time() + timeout
+        self.stop_pondering()
+        self.player = state.player
+        self.turn_time = self.clock.start(game, state, timeout)
+        self.table.new_search()
+        if self.ponder_hit:
+            # the ponder search started this position's killers and
+            # history already, keep them
+            self.orderer.reset_counts()
+        else:
+            self.prepare_orderer(game)
+        self.reset_stats()
+        game = self.instrument(game, GAME_PHASES)
+        state = game.copy_state(state)
+        self.prepare_evaluator(game, state)
         moves = game.legal_moves(state);
+        try:
+            if not moves:
+                return "pass"
+            if self.book is not None:
+                move = self.book.lookup(game, state)
+                if move in moves:
+                    return move
+            if game.empty_count(state) <= self.endgame:
+                move = self.solve_endgame(game, state)
+                if move:
+                    return move
+            entry = self.table.probe(state.hash)
+            moves = self.orderer.order(moves, 0, entry[3] if entry else None)
+            if self.iterative:
+                return self.deepen(game, state, moves)
+            else:
+                return self.fixed_depth(game, state, moves)
+        finally:
+            self.stats = self.turn_stats()
+            self.clock.stop()
+            self.ponder_hit = self.ponder_depth = None
+
+    def search_root(self, game, state, moves, depth):
+        """ Searches a window around the previous iteration's value
+            first and the full window only if the value falls outside.
+        """
+        if self.workers > 1 and len(moves) > 1:
+            return self.parallel_root(game, state, moves, depth)
+        guess = self.best_value
+        if guess is not None:
+            a, b = guess - self.ASPIRATION, guess + self.ASPIRATION
+            best_move, best_value = self.search_window(game, state, moves, depth, a, b)
+            if a < best_value < b:
+                return best_move, best_value
+        return self.search_window(game, state, moves, depth, -self.INFINITY, self.INFINITY)
+
+    def search_window(self, game, state, moves, depth, a, b):
+        a0 = a
+        best_value = -self.INFINITY
+        self.best_move = moves[0]
+        for i, move in enumerate(moves):
+            if time.time() >= self.turn_time:
+                raise SearchTimeout()
+            record = self.play(game, state, move)
+            if i == 0:
+                value = -self.negamax(game, state, depth, -b, -a, 1)
+            else:
+                value = -self.negamax(game, state, depth, -a - 1, -a, 1)
+                if a < value < b:
+                    value = -self.negamax(game, state, depth, -b, -a, 1)
+            self.unplay(game, state, record)
+            if(value > best_value):
+                best_value = value
+                self.best_move = move
+            if(best_value >= b):
+                break
+            if(best_value > a):
+                a = best_value
+        self.store(state, depth + 1, a0, b, best_value, self.best_move)
+        return self.best_move, best_value
+
+    def solve_endgame(self, game, state):
+        """ Perfect move if the solver finishes before the soft deadline,
+            otherwise None and the rest of the turn goes to normal search.
+        """
+        solver = EndgameSolver()
+        try:
+            _, move = solver.solve(game, game.copy_state(state), self.clock.soft)
+        except SearchTimeout:
+            return None
+        finally:
+            self.nodes += solver.nodes
+        return move
+
+    def parallel_root(self, game, state, moves, depth):
+        """ Young brothers wait at the root: search the first move here
+            to get a bound, then split the rest over the worker pool.
+            Workers share alpha and results are merged in root order,
+            so the chosen move doesn't depend on which worker finished
+            first.
+        """
+        if self.pool is None:
+            self.alpha = multiprocessing.Value('d', -self.INFINITY)
+            self.pool = multiprocessing.Pool(self.workers, _init_worker,
+                                             (self.tt_size, self.weights, self.alpha))
+
+        first = moves[0]
+        record = self.play(game, state, first)
+        best_value = -self.negamax(game, state, depth, -self.INFINITY, self.INFINITY, 1)
+        self.unplay(game, state, record)
+        self.best_move = first
+        self.alpha.value = best_value
+
+        tasks = [(untimed(game), state, move, depth, self.player, self.turn_time)
+                 for move in moves[1:]]
+        timed_out = False
+        for move, value, exact, counts in self.pool.map(_search_root_move, tasks):
+            nodes, leaves, cutoffs, first_cutoffs = counts
+            self.nodes += nodes
+            self.leaves += leaves
+            self.orderer.cutoffs += cutoffs
+            self.orderer.first_cutoffs += first_cutoffs
+            if value is None:
+                timed_out = True
+            elif exact and value > best_value:
+                best_value = value
+                self.best_move = move
+        if timed_out:
+            raise SearchTimeout()
+        self.table.store(state.hash, depth + 1, EXACT, best_value, self.best_move)
+        return self.best_move, best_value
+
+    def ponder(self, game, state):
+        """ Search the position after the reply we expect, taken from
+            the table, in a background thread until the opponent moves.
+            On a hit the table is warm for next_move, on a miss the
+            search is aborted. Not with workers, a pool search can't
+            be interrupted.
+        """
+        if not self.pondering or self.workers > 1:
+            return
+        entry = self.table.probe(state.hash)
+        expected = entry[3] if entry else None
+        if expected is None or expected not in game.legal_moves(state):
+            return
+        self.ponder_move = expected
+        self.turn_time = float("inf")
+        self.ponder_thread = threading.Thread(target=self.ponder_search,
+                                              args=(untimed(game), game.make_move(state, expected)))
+        self.ponder_thread.daemon = True
+        self.ponder_thread.start()
+
+    def ponder_search(self, game, state):
+        """ Iterative deepening until stop_pondering.
+        """
+        self.table.new_search()
+        self.prepare_orderer(game)
+        self.prepare_evaluator(game, state)
+        moves = game.legal_moves(state)
         if not moves:
-            return "pass"
+            return
+        entry = self.table.probe(state.hash)
+        moves = self.orderer.order(moves, 0, entry[3] if entry else None)
+        for depth in range(game.empty_count(state)):
+            try:
+                best_move, self.best_value = self.search_root(game, state, moves, depth)
+            except SearchTimeout:
+                return
+            self.ponder_depth = depth + 1
+            moves = [best_move] + [move for move in moves if move != best_move]
+
+    def opponent_moved(self, game, state, move):
+        if self.ponder_thread is None:
+            return
+        self.ponder_hit = move == self.ponder_move
+        if not self.ponder_hit:
+            self.stop_pondering()
+
+    def stop_pondering(self):
+        if self.ponder_thread is not None:
+            self.turn_time = 0
+            self.ponder_thread.join()
+            self.ponder_thread = None
+
+    def close(self):
+        self.stop_pondering()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def prepare_evaluator(self, game, state):
+        if self.patterns is None or (self.patterns.w, self.patterns.h) != (game.w, game.h):
+            self.patterns = PatternEvaluator(game.w, game.h, self.weights)
+        self.evaluator = self.instrument(self.patterns, EVALUATOR_PHASES)
+        self.evaluator.reset(game, state)
+
+    def play(self, game, state, move):
+        """ game.apply that keeps the pattern indices in step.
+        """
+        record = game.apply(state, move)
+        square, flipped = game.changes(record)
+        self.evaluator.update(record[2], square, flipped)
+        return record
+
+    def unplay(self, game, state, record):
+        game.undo(state, record)
+        square, flipped = game.changes(record)
+        self.evaluator.update(record[2], square, flipped, -1)
+
+    def evaluate(self, state):
+        """ Leaf score for the player to move. Pattern scores are a few
+            table lookups, cheaper than the cache, so they are only
+            remembered with cache_scores on (for costlier evaluators).
+        """
+        if self.cache_scores:
+            return self.cache.score(state, untimed(self.evaluator), self.evaluator.score)
+        return self.evaluator.score(state.player)
+
+    def prepare_orderer(self, game):
+        if self.orderer is None or (self.orderer.w, self.orderer.h) != (game.w, game.h):
+            self.orderer = MoveOrderer(game.w, game.h)
+        self.orderer.new_search()
+
+    def turn_stats(self):
+        stats = Agent.turn_stats(self)
+        stats["cutoffs"] = self.orderer.cutoffs if self.orderer else 0
+        stats["first_cutoff_rate"] = self.orderer.first_cutoff_rate() if self.orderer else None
+        stats["ponder_hit"] = self.ponder_hit
+        stats["ponder_depth"] = self.ponder_depth
+        return stats
+
+    def probe(self, state, depth, a, b):
+        """ (cutoff value or None, best move) from the table.
+        """
+        entry = self.table.probe(state.hash)
+        if not entry:
+            return None, None
+        entry_depth, flag, score, move = entry
+        if entry_depth >= depth:
+            if flag == EXACT:
+                return score, move
+            if flag == LOWER and score >= b:
+                return score, move
+            if flag == UPPER and score <= a:
+                return score, move
+        return None, move
+
+    def store(self, state, depth, a, b, best_value, best_move):
+        if best_value <= a:
+            flag = UPPER
+        elif best_value >= b:
+            flag = LOWER
         else:
-            best_value = -100000
-            best_move = None
-            ranked_moves = list()
-            for move in moves:
-                tup = (ranking[move],move)
-                ranked_moves.append(tup)
-            ranked_moves.sort(key=lambda tup: tup[0], reverse=True)
-            for tup in ranked_moves:
-                move = tup[1]
-                if time.time() >= self.turn_time:
-                    break
-                temp_state = game.make_move(state, move)
-                value = self.min_val(game, temp_state, self.depth, a, b, ranking)
-                if(value > best_value):
-                    best_value = value
-                    best_move = move
-                if(best_value > a):
-                    a = best_value
-            return best_move
-
-
-    def max_val(self, game, state, depth, a, b, ranking):
+            flag = EXACT
+        self.table.store(state.hash, depth, flag, best_value, best_move)
+
+    def negamax(self, game, state, depth, a, b, ply):
+        """ Principal variation search, fail-soft. Value for the player
+            to move in state: exact inside (a, b), otherwise a bound
+            on the side it fell.
+        """
+        self.nodes += 1
         if depth == 0:
-            max_moves, min_moves = self.legal_moves(game, state, self.player)
-            return self.heuristics(game, state, max_moves, min_moves)
-        else:
-            moves = game.legal_moves(state);
-            if not moves:
-                max_moves, min_moves = self.legal_moves(game, state, self.player)
-                return self.heuristics(game, state, max_moves, min_moves)
+            self.leaves += 1
+            return self.evaluate(state)
+        cutoff, tt_move = self.probe(state, depth, a, b)
+        if cutoff is not None:
+            return cutoff
+        moves = self.cache.moves(game, state)
+        if not moves:
+            self.leaves += 1
+            return self.evaluate(state)
+
+        a0 = a
+        best_value = -self.INFINITY
+        best_move = None
+        for i, move in enumerate(self.orderer.order(moves, ply, tt_move)):
+            if time.time() >= self.turn_time:
+                raise SearchTimeout()
+            record = self.play(game, state, move)
+            if i == 0:
+                value = -self.negamax(game, state, depth - 1, -b, -a, ply + 1)
             else:
-                depth -= 1
-                best_value = -100000
-                ranked_moves = list()
-                for move in moves:
-                    tup = (ranking[move],move)
-                    ranked_moves.append(tup)
-                ranked_moves.sort(key=lambda tup: tup[0], reverse=True)
-                for tup in ranked_moves:
-                    move = tup[1]
-                    if time.time() >= self.turn_time:
-                        break
-                    temp_state = game.make_move(state, move)
-                    value = self.min_val(game, temp_state, depth, a, b, ranking)
-                    if(value > best_value):
-                        best_value = value
-                    if(best_value >= b):
-                        return best_value
-                    if(best_value > a):
-                        a = best_value
-                return best_value
-
-
-    def min_val(self, game, state, depth, a, b, ranking):
-        if depth == 0:
-            max_moves, min_moves = self.legal_moves(game, state, self.player)
-            return self.heuristics(game, state, max_moves, min_moves)
-        else:
+                # prove the move is no better than the first one with a
+                # null window, search it properly only if that fails
+                value = -self.negamax(game, state, depth - 1, -a - 1, -a, ply + 1)
+                if a < value < b:
+                    value = -self.negamax(game, state, depth - 1, -b, -a, ply + 1)
+            self.unplay(game, state, record)
+            if value > best_value:
+                best_value = value
+                best_move = move
+            if best_value >= b:
+                self.orderer.cutoff(move, ply, depth, i)
+                break
+            if best_value > a:
+                a = best_value
+        self.store(state, depth, a0, b, best_value, best_move)
+        return best_value
+
+
+
+class MCTSNode:
+
+    def __init__(self, move, parent, mover, key):
+        self.move = move
+        self.parent = parent
+        # player who played move, wins are counted for them
+        self.mover = mover
+        self.key = key
+        self.children = []
+        self.untried = None
+        self.visits = 0
+        self.wins = 0.0
+
+    def select(self, c):
+        """ Child maximising UCT.
+        """
+        log_visits = math.log(self.visits)
+        return max(self.children, key=lambda child:
+                   child.wins / child.visits + c * math.sqrt(log_visits / child.visits))
+
+
+class MCTSAgent(Agent):
+    """ Monte Carlo tree search with UCT selection. Each iteration
+        plays batch random rollouts from the new leaf. With workers > 1
+        every worker process (or thread) grows its own tree from the
+        root for the whole turn and the root children's visits are
+        summed, so a turn costs one round trip to the pool whatever
+        the number of rollouts. The subtree of the position actually
+        reached is kept between turns. With a position database (see
+        database.py) new nodes start from the outcomes of the recorded
+        games through them, counted as up to prior_games visits.
+    """
+    prior_games = 20
+
+    def __init__(self, batch=8, workers=1, threads=False, c=1.4, game_time=None, database=None):
+        self.batch = batch
+        self.workers = workers
+        self.threads = threads
+        self.c = c
+        self.clock = TimeManager(game_time)
+        self.database = database
+        self.root = None
+        self.pool = None
+        self.rng = random.Random()
+
+    def next_move(self, game, state, timeout):
+        self.player = state.player
+        self.turn_time = self.clock.start(game, state, timeout)
+        self.reset_stats()
+        try:
             moves = game.legal_moves(state)
             if not moves:
-                max_moves, min_moves = self.legal_moves(game, state, self.player)
-                return self.heuristics(game, state, max_moves, min_moves)
+                self.root = None
+                return "pass"
+            if len(moves) == 1:
+                self.root = None
+                return moves[0]
+
+            if self.workers > 1:
+                return self.parallel_search(game, state)
+
+            self.search(game, state)
+            best = max(self.root.children, key=lambda child: child.visits)
+            self.best_value = best.wins / best.visits
+            return best.move
+        finally:
+            self.stats = self.turn_stats()
+            self.clock.stop()
+
+    def search(self, game, state):
+        """ Grows the tree from state until the turn time runs out.
+        """
+        self.root = self.reuse(state)
+        # at least one iteration, so the root has a child to play
+        # even when the clock has already run out
+        self.iterate(game, state)
+        while time.time() < self.turn_time:
+            self.iterate(game, state)
+
+    def parallel_search(self, game, state):
+        """ Root parallelism: each worker searches its own tree and the
+            move with the most visits over all of them is played.
+        """
+        if self.pool is None:
+            path = self.database.path if self.database is not None else None
+            args = (game, self.batch, self.c, path)
+            if self.threads:
+                from multiprocessing.pool import ThreadPool
+                self.pool = ThreadPool(self.workers, _init_mcts_worker, args)
             else:
-                depth -= 1
-                best_value = 100000
-                ranked_moves = list()
-                for move in moves:
-                    tup = (ranking[move],move)
-                    ranked_moves.append(tup)
-                ranked_moves.sort(key=lambda tup: tup[0], reverse=True)
-                for tup in ranked_moves:
-                    move = tup[1]
-                    if time.time() >= self.turn_time:
-                        break
-                    temp_state = game.make_move(state, move)
-                    value = self.max_val(game, temp_state, depth, a, b, ranking)
-                    if(value < best_value):
-                        best_value = value
-                    if(best_value >= a):
-                        return best_value
-                    if(best_value > b):
-                        b = best_value
-                return best_value
-
-    def value(self, min_player_value, max_player_value):
-        total = min_player_value + max_player_value
-        if total != 0:
-            return 100 * (max_player_value - min_player_value) / total
-        else:
-            return 0
-
-    def coin_parity(self, game, state):
-        max_coin = game.score_player(state, self.player)
-        min_coin = game.score_player(state, opponent(self.player))
-        return 100*(max_coin - min_coin)/(max_coin + min_coin)
-
-#    def stability(self, game, state, max_moves, min_moves):
-#        """ Stable, semi-stable and unstable coins """
-#        min_player_stability = 0
-#        max_player_stability = 0
-#
-#        for x in range(1, game.w):
-#            for y in range(1, game.h):
-#                point = game.map_2d(x, y)
-#                owner = state["board"][point]
-#                enemy = opponent(owner)
-#                coin_stability = -1 # unstable
-#
-#                for dir in game.directions:
-#                    hit = state["board"][point + dir]
-#                    if hit == enemy:
-#                        # Enemy found, we are now potentially flanked
-#                        back = state["board"][point - dir]
-#
-#
-#                if owner == self.player:
-#                    max_player_stability += coin_stability
-#                else:
-#                    min_player_stability += coin_stability
-
-    def corners(self, game, state, max_moves, min_moves):
-        """ Corner occupancy and closeness """
-        top_left = (1, 1)
-        top_right = (game.w, 1)
-        bot_left = (1, game.h)
-        bot_right = (game.w, game.h)
-        corners = [top_left, top_right, bot_left, bot_right]
-        enemy = opponent(self.player)
-
-        min_player_corner = 0
-        max_player_corner = 0
-
-        # Corner occupancy
-        for corner in corners:
-            coin_owner = state["board"][game.to_grid(corner)]
-            if coin_owner == self.player:
-                max_player_corner += 25
-            if coin_owner == enemy:
-                min_player_corner += 25
-
-        max_next_turn = lambda corner: 12.5 if corner in max_moves else 0
-        min_next_turn = lambda corner: 12.5 if corner in min_moves else 0
-
-        # Corner closeness/adjacency
-        min_player_corner += sum(list(map(min_next_turn, corners)))
-        max_player_corner += sum(list(map(min_next_turn, corners)))
-
-        return self.value(min_player_corner, max_player_corner)
-
-
-    def mobility(self, game, state, max_moves, min_moves):
-        """ Actual mobility """
-        min_player_mobility = len(min_moves)
-        max_player_mobility = len(max_moves)
-        return self.value(min_player_mobility, max_player_mobility)
-
-    def corner_closeness(self, game, state):
-        player_closeness = 0
-        enemy_closeness = 0
-        temp_player = 0
-        temp_enemy = 0
-        corner = (1,1)
-        first = (1,2)
-        second = (2,1)
-        third = (2,2)
-        temp_player, temp_enemy = self.calc_corner_closeness(game, state, corner, first, second, third)
-        player_closeness += temp_player
-        enemy_closeness += temp_enemy
-        corner = (1,9)
-        first = (1,8)
-        second = (2,9)
-        third = (2,8)
-        temp_player, temp_enemy = self.calc_corner_closeness(game, state, corner, first, second, third)
-        player_closeness += temp_player
-        enemy_closeness += temp_enemy
-        corner = (9,1)
-        first = (9,2)
-        second = (8,1)
-        third = (8,2)
-        temp_player, temp_enemy = self.calc_corner_closeness(game, state, corner, first, second, third)
-        player_closeness += temp_player
-        enemy_closeness += temp_enemy
-        corner = (9,9)
-        first = (9,8)
-        second = (8,9)
-        third = (8,8)
-        temp_player, temp_enemy = self.calc_corner_closeness(game, state, corner, first, second, third)
-        player_closeness += temp_player
-        enemy_closeness += temp_enemy
-        return 12.5 * (player_closeness - enemy_closeness);
-
-    def calc_corner_closeness(self, game, state, corner, first, second, third):
-        enemy = opponent(self.player)
-        player_closeness = 0
-        enemy_closeness = 0
-        if (state["board"][game.to_grid(corner)]) == ' ':
-            if (state["board"][game.to_grid(first)]) == self.player: player_closeness += 1
-            elif (state["board"][game.to_grid(first)]) == enemy: enemy_closeness += 1
-            if(state["board"][game.to_grid(second)]) == self.player: player_closeness += 1
-            elif (state["board"][game.to_grid(second)]) == enemy: enemy_closeness += 1
-            if(state["board"][game.to_grid(third)]) == self.player: player_closeness += 1
-            elif (state["board"][game.to_grid(third)]) == enemy: enemy_closeness += 1
-        return player_closeness, enemy_closeness
-
-    def heuristics(self, game, state, max_moves, min_moves):
-        """ Returns number of marks for the agent
+                self.pool = multiprocessing.Pool(self.workers, _init_mcts_worker, args)
+        tasks = [(state, self.turn_time, self.rng.getrandbits(32)) for _ in range(self.workers)]
+        visits = {}
+        wins = {}
+        for children, nodes in self.pool.map(_mcts_search, tasks, 1):
+            self.nodes += nodes
+            for move, child_visits, child_wins in children:
+                visits[move] = visits.get(move, 0) + child_visits
+                wins[move] = wins.get(move, 0) + child_wins
+        best = max(visits, key=visits.get)
+        self.best_value = wins[best] / visits[best]
+        return best
+
+    def reuse(self, state):
+        """ Node for state from last turn's tree, two plies below the
+            root searched then (or that root again), or a new root.
+        """
+        if self.root is not None:
+            if self.root.key == state.hash:
+                return self.root
+            for child in self.root.children:
+                for grandchild in child.children:
+                    if grandchild.key == state.hash:
+                        grandchild.parent = None
+                        return grandchild
+        return MCTSNode(None, None, opponent(state.player), state.hash)
+
+    def iterate(self, game, root_state):
+        node = self.root
+        state = game.copy_state(root_state)
+
+        # selection
+        while node.untried == [] and node.children:
+            node = node.select(self.c)
+            game.apply(state, node.move)
+
+        # expansion
+        if node.untried is None:
+            node.untried = self.successors(game, state)
+        if node.untried:
+            move = node.untried.pop(self.rng.randrange(len(node.untried)))
+            mover = state.player
+            game.apply(state, move)
+            child = MCTSNode(move, node, mover, state.hash)
+            if self.database is not None:
+                self.seed(child, game, state)
+            node.children.append(child)
+            node = child
+
+        # simulation
+        results = self.rollouts(game, state)
+        self.nodes += self.batch
+
+        # backpropagation
+        while node is not None:
+            node.visits += self.batch
+            node.wins += results.get(node.mover, 0) + 0.5 * results.get(None, 0)
+            node = node.parent
+
+    def seed(self, node, game, state):
+        """ Starts node, reached in state, from the database outcomes.
+        """
+        entry = self.database.lookup(game, state)
+        if entry is None:
+            return
+        # the entry scores state for the side to move, node.mover's opponent
+        score = 1 - entry.score()
+        node.visits = min(entry.games, self.prior_games)
+        node.wins = node.visits * score
+
+    def successors(self, game, state):
+        moves = game.legal_moves(state)
+        if moves:
+            return moves
+        record = game.apply(state, "pass")
+        over = not game.legal_moves(state)
+        game.undo(state, record)
+        return [] if over else ["pass"]
+
+    def rollouts(self, game, state):
+        """ {winner: count} over self.batch random playouts, None is a draw.
         """
-        h_corners = self.corners(game, state, max_moves, min_moves)
-        h_mobility = self.mobility(game, state, max_moves, min_moves)
-        h_coins = self.coin_parity(game, state)
-        h_closeness = self.corner_closeness(game, state)
-        return h_corners * 800 + h_closeness * 400 + h_mobility * 80 + h_coins * 8
-
-    def prepare_ranking(self, ranking):
-        #Used to rank moves for better alpha beta pruning
-        ranking[(1,1)] = 4
-        ranking[(1,2)] = -3
-        ranking[(1,3)] = 2
-        ranking[(1,4)] = 2
-        ranking[(1,5)] = 2
-        ranking[(1,6)] = 2
-        ranking[(1,7)] = -3
-        ranking[(1,8)] = 4
-        ranking[(2,1)] = -3
-        ranking[(2,2)] = -4
-        ranking[(2,3)] = -1
-        ranking[(2,4)] = -1
-        ranking[(2,5)] = -1
-        ranking[(2,6)] = -1
-        ranking[(2,7)] = -4
-        ranking[(2,8)] = -3
-        ranking[(3,1)] = 2
-        ranking[(3,2)] = -1
-        ranking[(3,3)] = 1
-        ranking[(3,4)] = 0
-        ranking[(3,5)] = 0
-        ranking[(3,6)] = 1
-        ranking[(3,7)] = -1
-        ranking[(3,8)] = 2
-        ranking[(4,1)] = 2
-        ranking[(4,2)] = -1
-        ranking[(4,3)] = 0
-        ranking[(4,4)] = 1
-        ranking[(4,5)] = 1
-        ranking[(4,6)] = 0
-        ranking[(4,7)] = -1
-        ranking[(4,8)] = 2
-        ranking[(5,1)] = 2
-        ranking[(5,2)] = -1
-        ranking[(5,3)] = 0
-        ranking[(5,4)] = 1
-        ranking[(5,5)] = 1
-        ranking[(5,6)] = 0
-        ranking[(5,7)] = -1
-        ranking[(5,8)] = 2
-        ranking[(6,1)] = 2
-        ranking[(6,2)] = -1
-        ranking[(6,3)] = 1
-        ranking[(6,4)] = 0
-        ranking[(6,5)] = 0
-        ranking[(6,6)] = 1
-        ranking[(6,7)] = -1
-        ranking[(6,8)] = 2
-        ranking[(7,1)] = -3
-        ranking[(7,2)] = -4
-        ranking[(7,3)] = -1
-        ranking[(7,4)] = -1
-        ranking[(7,5)] = -1
-        ranking[(7,6)] = -1
-        ranking[(7,7)] = -4
-        ranking[(7,8)] = -3
-        ranking[(8,1)] = 4
-        ranking[(8,2)] = -3
-        ranking[(8,3)] = 2
-        ranking[(8,4)] = 2
-        ranking[(8,5)] = 2
-        ranking[(8,6)] = 2
-        ranking[(8,7)] = -3
-        ranking[(8,8)] = 4
+        return _rollouts((game, state, self.batch, self.rng.getrandbits(32)))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+def _rollouts(task):
+    game, state, count, seed = task
+    rng = random.Random(seed)
+    results = {}
+    for _ in range(count):
+        playout = game.copy_state(state)
+        passes = 0
+        while passes < 2:
+            moves = game.legal_moves(playout)
+            if moves:
+                game.apply(playout, rng.choice(moves))
+                passes = 0
+            else:
+                game.apply(playout, "pass")
+                passes += 1
+        black = game.score_player(playout, BLACK)
+        white = game.score_player(playout, WHITE)
+        winner = None if black == white else BLACK if black > white else WHITE
+        results[winner] = results.get(winner, 0) + 1
+    return results
+
+
+# Parallel MCTS. Each pool process (or thread) keeps one MCTSAgent, and
+# with it a tree, for the whole game. The game is sent once, here.
+_mcts = threading.local()
+
+def _init_mcts_worker(game, batch, c, database):
+    if database is not None:
+        from database import PositionDatabase
+        database = PositionDatabase(database)
+    _mcts.game = game
+    _mcts.agent = MCTSAgent(batch, c=c, database=database)
+
+def _mcts_search(task):
+    """ ([(move, visits, wins)] for the root children, rollouts played).
+    """
+    state, deadline, seed = task
+    agent = _mcts.agent
+    agent.rng.seed(seed)
+    agent.turn_time = deadline
+    agent.nodes = 0
+    agent.search(_mcts.game, state)
+    children = [(child.move, child.visits, child.wins) for child in agent.root.children]
+    return children, agent.nodes
+
+
+# Parallel root search. Each pool process keeps one AlphaBetaAgent, and
+# with it a transposition table, for the whole game.
+_worker = None
+_alpha = None
+
+def _init_worker(tt_size, weights, alpha):
+    global _worker, _alpha
+    _worker = AlphaBetaAgent(0, tt_size, weights=weights)
+    _worker.reset_stats()
+    _worker.turn = None
+    _alpha = alpha
+
+def _search_root_move(task):
+    """ (move, value, exact, (nodes, leaves, cutoffs, first move
+        cutoffs)). value is None if time ran out and exact is False when
+        the move failed low against the shared alpha.
+    """
+    game, state, move, depth, player, deadline = task
+    if _worker.turn != state.turn:
+        _worker.turn = state.turn
+        _worker.table.new_search()
+        _worker.prepare_orderer(game)
+    # a timed out task leaves the indices mid-search, so always reset
+    _worker.prepare_evaluator(game, state)
+    _worker.player = player
+    _worker.turn_time = deadline
+    _worker.nodes = 0
+    _worker.leaves = 0
+    orderer = _worker.orderer
+    cutoffs, first_cutoffs = orderer.cutoffs, orderer.first_cutoffs
+
+    # one point below alpha, so moves that tie it still come back exact
+    a = _alpha.value - 1
+    record = _worker.play(game, state, move)
+    try:
+        value = -_worker.negamax(game, state, depth, -AlphaBetaAgent.INFINITY, -a, 1)
+    except SearchTimeout:
+        value = None
+    counts = (_worker.nodes, _worker.leaves, orderer.cutoffs - cutoffs,
+              orderer.first_cutoffs - first_cutoffs)
+    if value is None:
+        return move, None, False, counts
+    _worker.unplay(game, state, record)
+
+    with _alpha.get_lock():
+        if value > _alpha.value:
+            _alpha.value = value
+    return move, value, value > a, counts
@@ -0,0 +1,233 @@
+""" Vectorized engine that plays a whole population of games in
+    lockstep with NumPy.
+
+    Boards are an int8 array of shape (games, w, h) indexed [n, x-1, y-1]
+    with 1 for black, -1 for white and 0 for empty. Squares flatten as
+    (x-1)*h + (y-1), the order Reversi.legal_moves and the bitboard use.
+    A game ends after two passes in a row, like play_game in runner.py,
+    and finished games are refilled with the initial position.
+
+    python batch.py --games 10000 --size 4096 --black greedy --crosscheck
+"""
+import argparse
+import time
+
+import numpy as np
+
+from reversi import BLACK, WHITE
+
+DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1),
+              (-1, 1), (1, 1), (-1, -1), (1, -1)]
+PASS = -1
+
+
+def shift(a, dx, dy):
+    """ out[:, x, y] = a[:, x+dx, y+dy], False off the board.
+    """
+    out = np.zeros_like(a)
+    w, h = a.shape[1:]
+    if abs(dx) >= w or abs(dy) >= h:
+        return out
+    xs = slice(max(0, -dx), w - max(0, dx))
+    ys = slice(max(0, -dy), h - max(0, dy))
+    xd = slice(max(0, dx), w - max(0, -dx))
+    yd = slice(max(0, dy), h - max(0, -dy))
+    out[:, xs, ys] = a[:, xd, yd]
+    return out
+
+
+class BatchReversi:
+
+    def __init__(self, size, h=8, w=8):
+        self.size = size
+        self.h = h
+        self.w = w
+        self.boards = np.zeros((size, w, h), dtype=np.int8)
+        self.player = np.zeros(size, dtype=np.int8)
+        self.turn = np.zeros(size, dtype=np.int32)
+        self.passes = np.zeros(size, dtype=np.int8)
+        self.reset(np.ones(size, dtype=bool))
+
+    def reset(self, mask):
+        """ Initial position for the games in mask, black to move.
+        """
+        cx, cy = self.w // 2 - 1, self.h // 2 - 1
+        self.boards[mask] = 0
+        self.boards[mask, cx, cy] = -1
+        self.boards[mask, cx + 1, cy + 1] = -1
+        self.boards[mask, cx, cy + 1] = 1
+        self.boards[mask, cx + 1, cy] = 1
+        self.player[mask] = 1
+        self.turn[mask] = 1
+        self.passes[mask] = 0
+
+    def flip_counts(self):
+        """ (games, w, h) number of markers each square would flip for
+            the player to move, 0 for illegal squares.
+        """
+        player = self.player[:, None, None]
+        own = self.boards == player
+        opp = self.boards == -player
+        empty = self.boards == 0
+        longest = max(self.w, self.h)
+
+        counts = np.zeros(self.boards.shape, dtype=np.int16)
+        for dx, dy in DIRECTIONS:
+            run = shift(opp, dx, dy)
+            for k in range(2, longest):
+                if not run.any():
+                    break
+                closed = run & shift(own, k * dx, k * dy)
+                counts += closed * np.int16(k - 1)
+                run &= shift(opp, k * dx, k * dy)
+        counts *= empty
+        return counts
+
+    def legal_mask(self):
+        return self.flip_counts() > 0
+
+    def step(self, moves):
+        """ Plays one flat square index per game, PASS where the player
+            has no move. Returns the mask of games that just ended.
+        """
+        games = np.nonzero(moves != PASS)[0]
+        if len(games):
+            xs, ys = np.divmod(moves[games], self.h)
+            player = self.player[games]
+            boards = self.boards
+            boards[games, xs, ys] = player
+            for dx, dy in DIRECTIONS:
+                steps = np.arange(1, max(self.w, self.h))
+                rx = xs[:, None] + dx * steps
+                ry = ys[:, None] + dy * steps
+                inside = (rx >= 0) & (rx < self.w) & (ry >= 0) & (ry < self.h)
+                line = boards[games[:, None], np.clip(rx, 0, self.w - 1), np.clip(ry, 0, self.h - 1)]
+                line = np.where(inside, line, 0)
+                enemy = np.cumprod(line == -player[:, None], axis=1).astype(bool)
+                run = enemy.sum(axis=1)
+                end = np.minimum(run, len(steps) - 1)
+                closed = (run > 0) & (run < len(steps)) & \
+                    (line[np.arange(len(games)), end] == player)
+                flip = enemy & closed[:, None]
+                rows = np.nonzero(flip)
+                boards[games[rows[0]], rx[rows], ry[rows]] = player[rows[0]]
+
+        self.passes = np.where(moves == PASS, self.passes + 1, 0).astype(np.int8)
+        self.player = -self.player
+        self.turn += 1
+        return self.passes >= 2
+
+    def scores(self):
+        """ (black, white) disc counts per game.
+        """
+        black = (self.boards == 1).sum(axis=(1, 2))
+        white = (self.boards == -1).sum(axis=(1, 2))
+        return black, white
+
+
+def random_policy(counts, rng):
+    """ Uniformly random legal move per game, PASS without one.
+    """
+    flat = counts.reshape(len(counts), -1)
+    noise = rng.random(flat.shape) * (flat > 0)
+    moves = noise.argmax(axis=1)
+    return np.where(flat.any(axis=1), moves, PASS)
+
+
+def greedy_policy(counts, rng):
+    """ Move flipping the most markers, random among ties.
+    """
+    flat = counts.reshape(len(counts), -1).astype(np.float64)
+    flat += rng.random(flat.shape) * 0.5 * (flat > 0)
+    moves = flat.argmax(axis=1)
+    return np.where(flat.max(axis=1) > 0, moves, PASS)
+
+
+POLICIES = {"random": random_policy, "greedy": greedy_policy}
+
+
+def run(engine, games, black_policy, white_policy, seed=None):
+    """ Plays until games have finished, refilling finished slots.
+        Returns (black discs, white discs, turns) arrays per game.
+    """
+    rng = np.random.default_rng(seed)
+    black, white, turns = [], [], []
+    finished = 0
+    while finished < games:
+        counts = engine.flip_counts()
+        moves = np.where(engine.player == 1,
+                         black_policy(counts, rng),
+                         white_policy(counts, rng))
+        done = engine.step(moves)
+        if done.any():
+            b, w = engine.scores()
+            black.append(b[done])
+            white.append(w[done])
+            turns.append(engine.turn[done])
+            finished += int(done.sum())
+            engine.reset(done)
+    return (np.concatenate(black)[:games], np.concatenate(white)[:games],
+            np.concatenate(turns)[:games])
+
+
+def crosscheck(game, size=64, steps=200, seed=0):
+    """ Steps a random batch and a scalar engine side by side and raises
+        AssertionError on the first difference in legal moves or boards.
+    """
+    rng = np.random.default_rng(seed)
+    engine = BatchReversi(size, game.h, game.w)
+    states = [game.initial_state() for _ in range(size)]
+    for _ in range(steps):
+        counts = engine.flip_counts()
+        moves = random_policy(counts, rng)
+        for n in range(size):
+            legal = [x * game.h + y for x, y in
+                     ((mx - 1, my - 1) for mx, my in game.legal_moves(states[n]))]
+            assert legal == list(np.flatnonzero(counts[n].reshape(-1))), n
+            if moves[n] == PASS:
+                move = "pass"
+            else:
+                x, y = divmod(int(moves[n]), game.h)
+                move = (x + 1, y + 1)
+            states[n] = game.make_move(states[n], move)
+        done = engine.step(moves)
+        b, w = engine.scores()
+        for n in range(size):
+            assert b[n] == game.score_player(states[n], BLACK), n
+            assert w[n] == game.score_player(states[n], WHITE), n
+            if done[n]:
+                assert not game.legal_moves(states[n])
+                states[n] = game.initial_state()
+        engine.reset(done)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play many Reversi games in lockstep.")
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--size", help="games advanced at once", type=int, default=4096)
+    parser.add_argument("--black", choices=sorted(POLICIES), default="random")
+    parser.add_argument("--white", choices=sorted(POLICIES), default="random")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--crosscheck", help="compare against the scalar engine first", action="store_true")
+    args = parser.parse_args()
+
+    if args.crosscheck:
+        from bitboard import BitReversi
+        crosscheck(BitReversi())
+        print("crosscheck ok")
+
+    engine = BatchReversi(args.size)
+    time1 = time.time()
+    black, white, turns = run(engine, args.games, POLICIES[args.black],
+                              POLICIES[args.white], args.seed)
+    seconds = time.time() - time1
+    print("{} games in {:0.2f}s ({:0.0f} games/s)".format(args.games, seconds, args.games / seconds))
+    print("black wins {:0.1f}%, white wins {:0.1f}%, draws {:0.1f}%".format(
+        100.0 * (black > white).mean(), 100.0 * (white > black).mean(),
+        100.0 * (black == white).mean()))
+    print("mean discs black {:0.1f} white {:0.1f}, mean turns {:0.1f}".format(
+        black.mean(), white.mean(), turns.mean()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+""" Engine and search benchmarks.
+
+    python bench.py --engine bitboard --output bench.json --baseline baseline.json
+
+    perft: node counts from the initial position and a fixed corpus of
+           midgame positions, checked against known values
+    throughput: calls/sec for legal_moves, make_move, apply+undo and
+                leaf evaluation over the corpus
+    search: time and nodes for fixed-depth MinMaxAgent and AlphaBetaAgent
+            searches of every corpus position
+    equivalence: AlphaBetaAgent searching with MinMaxAgent's evaluation
+                 must return exactly MinMaxAgent's root value at every
+                 depth up to --verify-depth, in fewer nodes from depth 2,
+                 both at fixed depth and deepening through aspiration
+                 windows to the same depth
+
+    With --baseline the results are compared to a stored run and any
+    metric that got worse by more than --threshold is reported as a
+    regression (exit code 1). A missing baseline file is written.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+from reversi import Reversi, parse_move
+from bitboard import BitReversi
+from agents import MinMaxAgent, AlphaBetaAgent
+from patterns import PatternEvaluator
+
+ENGINES = {"list": Reversi, "bitboard": BitReversi}
+
+# perft(depth) from the 8x8 initial position, passes count as a move
+PERFT_INITIAL = [1, 4, 12, 56, 244, 1396, 8200, 55092, 390216]
+
+# midgame positions as move sequences from the initial position, with
+# perft(1), perft(2), perft(3)
+CORPUS = [
+    ("5f 6d 7c 4f 5c 6f 3g 4g 7g 7d 5g 7b",
+     [7, 65, 540]),
+    ("5f 4f 3c 6g 3f 3d 3g 6e 3e 5c 6d 2g 7f 2e 4g 6c 1e 2d 7b 2b",
+     [14, 171, 2197]),
+    ("3d 3c 6e 6f 5f 4f 3b 6d 7g 6g 3e 2d 7e 8e 1e 2b 4b 1d 5g 5b 2c 4h "
+     "7d 1f 2e 3f 4a 7h",
+     [15, 198, 2619]),
+    ("6e 4f 3e 6d 5g 6f 7e 3f 6c 2e 2d 5f 5c 6g 6h 2c 1e 3d 1b 2f 3g 4g "
+     "3h 7b 6b 4c 8a 1g 4b 5b 5a 4h 3c 2b 1d 7g",
+     [10, 109, 1132]),
+    ("3d 3c 3b 5c 6f 2d 1e 4f 5b 2b 3f 6b 3g 5f 1a 5a 6d 3a 4b 1b 7a 2g "
+     "5g 6g 7g 5h 2f 2e 6h 6c 1g 1d 7c 7e 7d 2h 7f 4g 4h 8h 4c 8e 1f 6e",
+     [14, 157, 1820]),
+    ("5f 6f 3d 5c 6b 2d 3e 3c 7f 2e 2c 5g 3f 7a 3b 2f 4h 3a 4c 5h 4f 7e "
+     "4a 2b 1e 3g 8d 6g 6e 3h 2a 1d 1g 1a 7g 6c 7c 1c 4b 2g 6a 8h 1h 5b "
+     "1b 8c 8a 8f 8e 4g",
+     [8, 49, 307]),
+]
+
+
+def perft(game, state, depth):
+    """ Number of move sequences of length depth. A pass is a move and
+        a finished game is a single leaf.
+    """
+    if depth == 0:
+        return 1
+    moves = game.legal_moves(state)
+    if not moves:
+        record = game.apply(state, "pass")
+        if game.legal_moves(state):
+            nodes = perft(game, state, depth - 1)
+        else:
+            nodes = 1
+        game.undo(state, record)
+        return nodes
+
+    nodes = 0
+    for move in moves:
+        record = game.apply(state, move)
+        nodes += perft(game, state, depth - 1)
+        game.undo(state, record)
+    return nodes
+
+
+def corpus_states(game):
+    states = []
+    for moves, _ in CORPUS:
+        state = game.initial_state()
+        for text in moves.split():
+            state = game.make_move(state, parse_move(text))
+        states.append(state)
+    return states
+
+
+def perft_suite(game, depth, midgame_depth):
+    results = {"initial": [], "corpus": [], "errors": []}
+    for d in range(1, depth + 1):
+        time1 = time.time()
+        nodes = perft(game, game.initial_state(), d)
+        seconds = time.time() - time1
+        results["initial"].append({"depth": d, "nodes": nodes, "time": seconds})
+        if d < len(PERFT_INITIAL) and nodes != PERFT_INITIAL[d]:
+            results["errors"].append("perft({}) from initial is {}, expected {}".format(
+                d, nodes, PERFT_INITIAL[d]))
+
+    for i, state in enumerate(corpus_states(game)):
+        expected = CORPUS[i][1]
+        for d in range(1, midgame_depth + 1):
+            nodes = perft(game, state, d)
+            results["corpus"].append({"position": i, "depth": d, "nodes": nodes})
+            if d <= len(expected) and nodes != expected[d - 1]:
+                results["errors"].append("perft({}) of corpus position {} is {}, expected {}".format(
+                    d, i, nodes, expected[d - 1]))
+    return results
+
+
+def rate(func, states, seconds):
+    """ Calls per second of func(state) cycling over states.
+    """
+    calls = 0
+    time1 = time.time()
+    deadline = time1 + seconds
+    while time.time() < deadline:
+        for state in states:
+            func(state)
+        calls += len(states)
+    return calls / (time.time() - time1)
+
+
+def throughput_suite(game, seconds):
+    states = corpus_states(game)
+    moves = dict((id(state), game.legal_moves(state)[0]) for state in states)
+
+    def make_move(state):
+        game.make_move(state, moves[id(state)])
+
+    def apply_undo(state):
+        game.undo(state, game.apply(state, moves[id(state)]))
+
+    # one evaluator per position, as a search keeps one per game
+    evaluators = {}
+    for state in states:
+        evaluators[id(state)] = PatternEvaluator(game.w, game.h)
+        evaluators[id(state)].reset(game, state)
+
+    def evaluate(state):
+        """ Leaf cost in search: update the patterns for a move, score,
+            take it back.
+        """
+        evaluator = evaluators[id(state)]
+        record = game.apply(state, moves[id(state)])
+        square, flipped = game.changes(record)
+        evaluator.update(record[2], square, flipped)
+        evaluator.score(state["player"])
+        game.undo(state, record)
+        evaluator.update(record[2], square, flipped, -1)
+
+    return {
+        "legal_moves": rate(game.legal_moves, states, seconds),
+        "make_move": rate(make_move, states, seconds),
+        "apply_undo": rate(apply_undo, states, seconds),
+        "evaluate": rate(evaluate, states, seconds)
+    }
+
+
+def search_suite(game, minmax_depth, alphabeta_depth):
+    results = {}
+    for name, make_agent, depth in (("minmax", MinMaxAgent, minmax_depth),
+                                    ("alphabeta", AlphaBetaAgent, alphabeta_depth)):
+        total = 0.0
+        nodes = 0
+        moves = []
+        for state in corpus_states(game):
+            # fresh agent per position so tables don't carry over
+            agent = make_agent(depth)
+            time1 = time.time()
+            move = agent.next_move(game, state, 3600)
+            total += time.time() - time1
+            nodes += agent.stats["nodes"]
+            moves.append(list(move) if move != "pass" else move)
+        results[name] = {"depth": depth, "time": total, "nodes": nodes, "moves": moves}
+    return results
+
+
+class DiscCount:
+    """ MinMaxAgent's evaluation, the root player's discs, through the
+        evaluator interface and negated for the opponent, as negamax
+        expects.
+    """
+
+    def __init__(self, player):
+        self.player = player
+
+    def reset(self, game, state):
+        self.game = game
+        self.state = state
+
+    def update(self, player, square, flipped, sign=1):
+        pass
+
+    def score(self, player):
+        discs = self.game.score_player(self.state, self.player)
+        return discs if player == self.player else -discs
+
+
+class DiscCountAlphaBeta(AlphaBetaAgent):
+
+    def prepare_evaluator(self, game, state):
+        self.evaluator = DiscCount(self.player)
+        self.evaluator.reset(game, state)
+
+
+class DeepeningDiscCount(DiscCountAlphaBeta):
+    """ Iterative deepening that stops after self.depth, with a window
+        narrow enough that disc counts regularly fall outside it.
+        Counts the iterations that had to search again.
+    """
+    ASPIRATION = 1
+
+    def __init__(self, depth):
+        DiscCountAlphaBeta.__init__(self, depth, iterative=True)
+        self.fail_high = 0
+        self.fail_low = 0
+
+    def deepen(self, game, state, moves):
+        return AlphaBetaAgent.deepen(self, game, state, moves, self.depth)
+
+    def search_window(self, game, state, moves, depth, a, b):
+        best_move, best_value = AlphaBetaAgent.search_window(self, game, state, moves, depth, a, b)
+        if a > -self.INFINITY and best_value <= a:
+            self.fail_low += 1
+        elif b < self.INFINITY and best_value >= b:
+            self.fail_high += 1
+        return best_move, best_value
+
+
+# below this depth alpha-beta has too little to prune to beat min-max
+PRUNING_DEPTH = 2
+
+
+def equivalence_suite(game, max_depth):
+    """ Root values and nodes of MinMaxAgent and AlphaBetaAgent (same
+        evaluation) per depth over the corpus, searched to a fixed depth
+        and by iterative deepening with aspiration windows. Any value
+        that differs is an error, and so is alpha-beta not visiting
+        fewer nodes from PRUNING_DEPTH on.
+    """
+    rows = []
+    errors = []
+    for depth in range(max_depth + 1):
+        row = {"depth": depth, "minmax_nodes": 0, "alphabeta_nodes": 0,
+               "fail_high": 0, "fail_low": 0}
+        for index, state in enumerate(corpus_states(game)):
+            minmax = MinMaxAgent(depth)
+            alphabeta = DiscCountAlphaBeta(depth)
+            deepening = DeepeningDiscCount(depth)
+            minmax.next_move(game, state, 3600)
+            alphabeta.next_move(game, state, 3600)
+            deepening.next_move(game, state, 3600)
+            row["minmax_nodes"] += minmax.stats["nodes"]
+            row["alphabeta_nodes"] += alphabeta.stats["nodes"]
+            row["fail_high"] += deepening.fail_high
+            row["fail_low"] += deepening.fail_low
+            if minmax.stats["value"] != alphabeta.stats["value"]:
+                errors.append("depth {} position {}: minmax {} alphabeta {}".format(
+                    depth, index, minmax.stats["value"], alphabeta.stats["value"]))
+            if deepening.stats["depth"] != depth + 1:
+                errors.append("depth {} position {}: deepening stopped at depth {}".format(
+                    depth, index, deepening.stats["depth"]))
+            elif minmax.stats["value"] != deepening.stats["value"]:
+                errors.append("depth {} position {}: minmax {} deepening alphabeta {}".format(
+                    depth, index, minmax.stats["value"], deepening.stats["value"]))
+        if depth >= PRUNING_DEPTH and row["alphabeta_nodes"] >= row["minmax_nodes"]:
+            errors.append("depth {}: alphabeta visited {} nodes, minmax {}".format(
+                depth, row["alphabeta_nodes"], row["minmax_nodes"]))
+        rows.append(row)
+    return {"depths": rows, "errors": errors}
+
+
+def compare(results, baseline, threshold):
+    """ List of regressions of results against baseline.
+    """
+    regressions = []
+    for key, value in sorted(results["throughput"].items()):
+        old = baseline.get("throughput", {}).get(key)
+        if old and value < old * (1 - threshold):
+            regressions.append("throughput {}: {:0.0f}/s, baseline {:0.0f}/s ({:+0.1f}%)".format(
+                key, value, old, 100.0 * (value - old) / old))
+
+    for name, search in sorted(results["search"].items()):
+        old = baseline.get("search", {}).get(name)
+        if not old or old["depth"] != search["depth"]:
+            continue
+        if search["time"] > old["time"] * (1 + threshold):
+            regressions.append("search {}: {:0.3f}s, baseline {:0.3f}s ({:+0.1f}%)".format(
+                name, search["time"], old["time"], 100.0 * (search["time"] - old["time"]) / old["time"]))
+        if search["nodes"] > old["nodes"] * (1 + threshold):
+            regressions.append("search {}: {} nodes, baseline {}".format(
+                name, search["nodes"], old["nodes"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Reversi engines and agents.")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="bitboard")
+    parser.add_argument("--perft-depth", type=int, default=6, dest="perft_depth")
+    parser.add_argument("--midgame-depth", type=int, default=3, dest="midgame_depth")
+    parser.add_argument("--seconds", help="time per throughput measurement", type=float, default=1.0)
+    parser.add_argument("--minmax-depth", type=int, default=2, dest="minmax_depth")
+    parser.add_argument("--alphabeta-depth", type=int, default=3, dest="alphabeta_depth")
+    parser.add_argument("--verify-depth", help="check alphabeta against minmax up to this depth",
+                        type=int, default=3, dest="verify_depth")
+    parser.add_argument("--output", help="write results as JSON to this file", default="bench.json")
+    parser.add_argument("--baseline", help="compare against this results file, written if missing")
+    parser.add_argument("--threshold", help="allowed slowdown before flagging, 0.1 is 10%%", type=float, default=0.1)
+    args = parser.parse_args()
+
+    game = ENGINES[args.engine]()
+    results = {
+        "engine": args.engine,
+        "python": platform.python_version(),
+        "time": time.time(),
+        "perft": perft_suite(game, args.perft_depth, args.midgame_depth),
+        "throughput": throughput_suite(game, args.seconds),
+        "search": search_suite(game, args.minmax_depth, args.alphabeta_depth),
+        "equivalence": equivalence_suite(game, args.verify_depth)
+    }
+
+    with open(args.output, "w") as out:
+        json.dump(results, out, indent=2, sort_keys=True)
+
+    for row in results["perft"]["initial"]:
+        print("perft({}) = {} in {:0.3f}s".format(row["depth"], row["nodes"], row["time"]))
+    for key, value in sorted(results["throughput"].items()):
+        print("{:<12} {:>12.0f}/s".format(key, value))
+    for name, search in sorted(results["search"].items()):
+        print("{:<12} depth {} {:>8.3f}s {:>10} nodes".format(
+            name, search["depth"], search["time"], search["nodes"]))
+
+    for row in results["equivalence"]["depths"]:
+        print("depth {} minmax {:>10} nodes, alphabeta {:>8} nodes, aspiration fail high {} low {}".format(
+            row["depth"], row["minmax_nodes"], row["alphabeta_nodes"], row["fail_high"], row["fail_low"]))
+
+    failed = False
+    for error in results["perft"]["errors"] + results["equivalence"]["errors"]:
+        print("ERROR " + error)
+        failed = True
+
+    if args.baseline:
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        except IOError:
+            with open(args.baseline, "w") as out:
+                json.dump(results, out, indent=2, sort_keys=True)
+            print("wrote baseline {}".format(args.baseline))
+        else:
+            if baseline.get("engine") != results["engine"]:
+                print("baseline {} is for the {} engine, not comparing".format(
+                    args.baseline, baseline.get("engine")))
+                baseline = {}
+            for regression in compare(results, baseline, args.threshold):
+                print("REGRESSION " + regression)
+                failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
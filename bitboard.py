@@ -0,0 +1,348 @@
+from string import ascii_lowercase
+from sys import stdout
+
+from reversi import EMPTY, BLACK, WHITE, BORDER, opponent, zobrist_keys
+from position import Position
+
+# Square (x, y) lives at bit (x-1)*8 + (y-1), so walking the bits from low
+# to high visits moves in the same order as Reversi.legal_moves.
+SIZE = 8
+FULL = 0xFFFFFFFFFFFFFFFF
+NOT_Y1 = 0xFEFEFEFEFEFEFEFE
+NOT_Y8 = 0x7F7F7F7F7F7F7F7F
+
+SQUARES = [(x, y) for x in range(1, SIZE + 1) for y in range(1, SIZE + 1)]
+BITS = dict((move, 1 << i) for i, move in enumerate(SQUARES))
+
+# zobrist keys per bit and colour, FLIP_KEYS toggles both at once
+_keys = zobrist_keys(2 * SIZE * SIZE + 1)
+ZOBRIST = {BLACK: _keys[:SIZE * SIZE], WHITE: _keys[SIZE * SIZE:-1]}
+ZOBRIST_SIDE = _keys[-1]
+FLIP_KEYS = [b ^ w for b, w in zip(ZOBRIST[BLACK], ZOBRIST[WHITE])]
+
+
+def popcount(bits):
+    return bin(bits).count("1")
+
+
+def shift_e(b):
+    return (b << 8) & FULL
+
+
+def shift_w(b):
+    return b >> 8
+
+
+def shift_s(b):
+    return (b << 1) & NOT_Y1
+
+
+def shift_n(b):
+    return (b >> 1) & NOT_Y8
+
+
+def shift_se(b):
+    return (b << 9) & NOT_Y1 & FULL
+
+
+def shift_ne(b):
+    return (b << 7) & NOT_Y8 & FULL
+
+
+def shift_sw(b):
+    return (b >> 7) & NOT_Y1
+
+
+def shift_nw(b):
+    return (b >> 9) & NOT_Y8
+
+
+SHIFTS = [shift_w, shift_e, shift_n, shift_s,
+          shift_sw, shift_se, shift_nw, shift_ne]
+
+
+# (shift, mask) per direction, the mask keeps a line from wrapping
+# onto the next column, for moves_mask where the shifts are inlined
+LEFT_SHIFTS = [(8, FULL), (1, NOT_Y1), (9, NOT_Y1 & FULL), (7, NOT_Y8 & FULL)]
+RIGHT_SHIFTS = [(8, FULL), (1, NOT_Y8), (7, NOT_Y1), (9, NOT_Y8)]
+
+
+def moves_mask(own, opp):
+    """ Every empty square that brackets at least one
+        enemy line, for all 8 directions at once.
+    """
+    empty = ~(own | opp) & FULL
+    moves = 0
+    for n, mask in LEFT_SHIFTS:
+        o = opp & mask
+        t = (own << n) & o
+        t |= (t << n) & o
+        t |= (t << n) & o
+        t |= (t << n) & o
+        t |= (t << n) & o
+        t |= (t << n) & o
+        moves |= (t << n) & mask
+    for n, mask in RIGHT_SHIFTS:
+        o = opp & mask
+        t = (own >> n) & o
+        t |= (t >> n) & o
+        t |= (t >> n) & o
+        t |= (t >> n) & o
+        t |= (t >> n) & o
+        t |= (t >> n) & o
+        moves |= (t >> n) & mask
+    return moves & empty
+
+
+def flips_mask(own, opp, bit):
+    """ Enemy markers flipped by placing own marker on bit.
+    """
+    flips = 0
+    for shift in SHIFTS:
+        line = 0
+        loc = shift(bit)
+        while loc & opp:
+            line |= loc
+            loc = shift(loc)
+        if loc & own:
+            flips |= line
+    return flips
+
+
+# the 8 symmetries of the square as maps of (x, y), SYMMETRY_INVERSE[t]
+# undoes SYMMETRIES[t]
+_n = SIZE + 1
+SYMMETRIES = [
+    lambda x, y: (x, y),
+    lambda x, y: (y, _n - x),
+    lambda x, y: (_n - x, _n - y),
+    lambda x, y: (_n - y, x),
+    lambda x, y: (_n - x, y),
+    lambda x, y: (x, _n - y),
+    lambda x, y: (y, x),
+    lambda x, y: (_n - y, _n - x),
+]
+SYMMETRY_INVERSE = [0, 3, 2, 1, 4, 5, 6, 7]
+SYMMETRY_BITS = [[BITS[sym(*move)] for move in SQUARES] for sym in SYMMETRIES]
+
+
+def transform(bits, t):
+    """ bits with symmetry t applied to every square.
+    """
+    table = SYMMETRY_BITS[t]
+    out = 0
+    while bits:
+        low = bits & -bits
+        out |= table[low.bit_length() - 1]
+        bits ^= low
+    return out
+
+
+def transform_move(move, t):
+    return move if move == "pass" else SYMMETRIES[t](*move)
+
+
+def canonical(own, opp):
+    """ (own, opp, t): the smallest of the 8 symmetric images of the
+        position and the symmetry t that produces it.
+    """
+    best = None
+    for t in range(len(SYMMETRIES)):
+        image = (transform(own, t), transform(opp, t), t)
+        if best is None or image[:2] < best[:2]:
+            best = image
+    return best
+
+
+def to_bits(game, state):
+    """ (own, opp) masks for the player to move, from either engine.
+    """
+    if "black" in state:
+        black, white = state["black"], state["white"]
+    else:
+        black = white = 0
+        for move in SQUARES:
+            owner = game.owner(state, move)
+            if owner == BLACK:
+                black |= BITS[move]
+            elif owner == WHITE:
+                white |= BITS[move]
+    return (black, white) if state["player"] == BLACK else (white, black)
+
+
+def bits_to_moves(bits):
+    moves = []
+    while bits:
+        low = bits & -bits
+        moves.append(SQUARES[low.bit_length() - 1])
+        bits ^= low
+    return moves
+
+
+class BitReversi:
+    """ 8x8 Reversi on a pair of 64-bit integers, one per colour.
+        Same interface as reversi.Reversi, but states are Positions
+        carrying black and white masks instead of a board list.
+    """
+
+    def __init__(self, h=8, w=8):
+        if (h, w) != (SIZE, SIZE):
+            raise ValueError("BitReversi only supports 8x8 boards")
+        self.h = h
+        self.w = w
+
+    def initial_state(self):
+        """ Black starts
+        """
+        black = BITS[(4, 5)] | BITS[(5, 4)]
+        white = BITS[(4, 4)] | BITS[(5, 5)]
+        state = Position(1, BLACK, black, white, 0, 2, 2)
+        state.hash = self.hash_state(state)
+        return state
+
+    def hash_state(self, state):
+        """ Zobrist key of state from scratch, apply() keeps
+            state["hash"] up to date incrementally.
+        """
+        key = ZOBRIST_SIDE if state["player"] == WHITE else 0
+        for colour in (BLACK, WHITE):
+            bits = state["black"] if colour == BLACK else state["white"]
+            while bits:
+                low = bits & -bits
+                key ^= ZOBRIST[colour][low.bit_length() - 1]
+                bits ^= low
+        return key
+
+    def sides(self, state):
+        """ (own, opp) masks for player to move.
+        """
+        if state.player == BLACK:
+            return state.black, state.white
+        return state.white, state.black
+
+    def owner(self, state, move):
+        bit = BITS.get(move)
+        if bit is None:
+            return BORDER
+        if state["black"] & bit:
+            return BLACK
+        if state["white"] & bit:
+            return WHITE
+        return EMPTY
+
+    def is_legal_move(self, state, move):
+        bit = BITS.get(move)
+        if bit is None or (state["black"] | state["white"]) & bit:
+            return None
+
+        own, opp = self.sides(state)
+        return flips_mask(own, opp, bit) != 0
+
+    def legal_moves(self, state):
+        own, opp = self.sides(state)
+        return bits_to_moves(moves_mask(own, opp))
+
+    def make_move(self, state, move):
+        """ Returns next game state with move applied.
+        """
+        state = state.copy()
+        self.apply(state, move)
+        return state
+
+    def copy_state(self, state):
+        return state.copy()
+
+    def apply(self, state, move):
+        """ Applies move to state in place and returns an undo
+            record (move bit, flipped mask, player, turn, hash).
+        """
+        player = state.player
+        turn = state.turn
+        key = state.hash
+        bit = flips = 0
+
+        if move != "pass":
+            bit = BITS[move]
+            update = ZOBRIST[player][bit.bit_length() - 1]
+            if player == BLACK:
+                flips = flips_mask(state.black, state.white, bit)
+                state.black |= flips | bit
+                state.white ^= flips
+            else:
+                flips = flips_mask(state.white, state.black, bit)
+                state.white |= flips | bit
+                state.black ^= flips
+
+            flipped = 0
+            rest = flips
+            while rest:
+                low = rest & -rest
+                update ^= FLIP_KEYS[low.bit_length() - 1]
+                rest ^= low
+                flipped += 1
+            state.hash = key ^ update
+            state.count(player == BLACK, flipped, 1)
+
+        state.hash ^= ZOBRIST_SIDE
+        state.turn = turn + 1
+        state.player = opponent(player)
+        return bit, flips, player, turn, key
+
+    def undo(self, state, record):
+        """ Reverts an apply() given its undo record.
+        """
+        bit, flips, player, turn, key = record
+
+        if bit:
+            if player == BLACK:
+                state.black ^= flips | bit
+                state.white |= flips
+            else:
+                state.white ^= flips | bit
+                state.black |= flips
+            state.count(player == BLACK, popcount(flips), -1)
+
+        state.turn = turn
+        state.player = player
+        state.hash = key
+
+    def changes(self, record):
+        """ (square, flipped squares) of an undo record, squares numbered
+            by bit, square None for a pass.
+        """
+        bit, flips = record[:2]
+        if not bit:
+            return None, ()
+        flipped = []
+        while flips:
+            low = flips & -flips
+            flipped.append(low.bit_length() - 1)
+            flips ^= low
+        return bit.bit_length() - 1, flipped
+
+    def over(self, state):
+        """ Check if it's game over for current player.
+        """
+        own, opp = self.sides(state)
+        return not moves_mask(own, opp)
+
+    def empty_count(self, state):
+        return SIZE * SIZE - state.black_count - state.white_count
+
+    def top_scoring_player(self, state):
+        black = self.score_player(state, BLACK)
+        white = self.score_player(state, WHITE)
+        return (WHITE, white) if white > black else (BLACK, black)
+
+    def print_board(self, state):
+        print("  {}".format(' '.join(ascii_lowercase[0:self.w])))
+
+        for y in range(1, self.h + 1):
+            row = [self.owner(state, (x, y)) for x in range(1, self.w + 1)]
+            print('{} {}'.format(str(y), ' '.join(row)))
+            stdout.flush()
+
+    def score_player(self, state, player):
+        """ Score(Player) = Count(Markers for Player)
+        """
+        return state.black_count if player == BLACK else state.white_count
@@ -0,0 +1,153 @@
+""" Opening book.
+
+    python book.py --plies 6 --depth 4 --output book.bin
+
+    The builder expands every position within the first plies from the
+    initial position, folds symmetric positions together and searches
+    each one with AlphaBetaAgent. The book file is a sorted array of
+    fixed-size records, looked up by binary search over an mmap so it
+    opens instantly and is shared between processes.
+
+    Record: own discs, opponent discs (the canonical symmetric image,
+    from the side to move), search score, best move as a square index
+    in the canonical frame (255 is pass).
+"""
+import argparse
+import mmap
+import multiprocessing
+import os
+import struct
+
+from bitboard import (BitReversi, SQUARES, canonical, to_bits,
+                      transform_move, SYMMETRY_INVERSE)
+
+RECORD = struct.Struct("<QQiB3x")
+PASS = 255
+
+
+def expand(game, plies):
+    """ {canonical (own, opp): (state, t)} for every position within
+        plies of the initial position.
+    """
+    positions = {}
+    frontier = [game.initial_state()]
+    for ply in range(plies + 1):
+        next_frontier = []
+        for state in frontier:
+            own, opp, t = canonical(*to_bits(game, state))
+            if (own, opp) in positions:
+                continue
+            positions[own, opp] = (state, t)
+            if ply < plies:
+                for move in game.legal_moves(state):
+                    next_frontier.append(game.make_move(state, move))
+        frontier = next_frontier
+    return positions
+
+
+def search_position(task):
+    from agents import AlphaBetaAgent
+    key, state, t, depth, timeout = task
+    game = BitReversi()
+    agent = AlphaBetaAgent(depth)
+    move = agent.next_move(game, state, timeout)
+    value = agent.stats["value"] or 0
+    return key, transform_move(move, t), int(value)
+
+
+def build(plies, depth, timeout=3600, processes=None):
+    """ Sorted list of (own, opp, score, move index) records.
+    """
+    game = BitReversi()
+    positions = expand(game, plies)
+    tasks = [(key, state, t, depth, timeout)
+             for key, (state, t) in positions.items()
+             if game.legal_moves(state)]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(search_position, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    records = []
+    for (own, opp), move, score in results:
+        index = PASS if move == "pass" else SQUARES.index(move)
+        records.append((own, opp, score, index))
+    records.sort()
+    return records
+
+
+def write(path, records):
+    with open(path, "wb") as out:
+        for record in records:
+            out.write(RECORD.pack(*record))
+
+
+class OpeningBook:
+    """ Read-only view of a book file.
+    """
+
+    def __init__(self, path):
+        self.size = os.path.getsize(path) // RECORD.size
+        self.file = open(path, "rb")
+        self.data = None
+        if self.size:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.size
+
+    def find(self, own, opp):
+        """ (score, move index) stored for the canonical position, or None.
+        """
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key = RECORD.unpack_from(self.data, mid * RECORD.size)
+            if key[:2] < (own, opp):
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.size:
+            record = RECORD.unpack_from(self.data, lo * RECORD.size)
+            if record[:2] == (own, opp):
+                return record[2:]
+        return None
+
+    def lookup(self, game, state):
+        """ Book move for state in the game's own frame, or None.
+        """
+        if (game.w, game.h) != (8, 8):
+            return None
+        own, opp, t = canonical(*to_bits(game, state))
+        found = self.find(own, opp)
+        if found is None:
+            return None
+        _, index = found
+        move = "pass" if index == PASS else SQUARES[index]
+        return transform_move(move, SYMMETRY_INVERSE[t])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a Reversi opening book.")
+    parser.add_argument("--plies", help="expand this many plies from the start", type=int, default=6)
+    parser.add_argument("--depth", help="alphabeta search depth per position", type=int, default=4)
+    parser.add_argument("--timeout", help="max seconds per position", type=int, default=3600)
+    parser.add_argument("--processes", help="search processes, defaults to one per core", type=int, default=None)
+    parser.add_argument("--output", default="book.bin")
+    args = parser.parse_args()
+
+    records = build(args.plies, args.depth, args.timeout, args.processes)
+    write(args.output, records)
+    print("wrote {} positions to {}".format(len(records), args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+
+# evaluator of an entry nothing has scored yet
+UNSCORED = object()
+
+
+class PositionCache:
+    """ Move lists of recently searched positions, and leaf scores for
+        agents that cache them (see AlphaBetaAgent.cache_scores, off by
+        default), keyed by state.key(), the Zobrist hash (which includes
+        the player to move) and the discs, and evicting the least
+        recently used entry past size entries. Not tied to an agent or
+        a turn: several agents playing the same game can share one and
+        it stays warm between turns.
+
+        Entries are [moves, evaluator, score], filled in as they are
+        asked for, a score is only reused by the evaluator that computed
+        it. Callers must not change the move lists they get back.
+
+        Lookups take a lock, since a pondering agent searches in a
+        thread while the other player (or the agent itself) uses the
+        same cache, and every lookup reorders the LRU.
+    """
+
+    def __init__(self, size=100000):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def entry(self, state):
+        """ The entry for state, created empty if missing, now the most
+            recently used. Call with the lock held.
+        """
+        entries = self.entries
+        key = state.key()
+        entry = entries.pop(key, None)
+        if entry is None:
+            entry = [None, UNSCORED, None]
+            if len(entries) >= self.size:
+                entries.popitem(last=False)
+        entries[key] = entry
+        return entry
+
+    def moves(self, game, state):
+        with self.lock:
+            entry = self.entry(state)
+            moves = entry[0]
+            if moves is not None:
+                self.hits += 1
+                return moves
+            self.misses += 1
+        # outside the lock, another thread may fill it in meanwhile,
+        # with the same list
+        moves = entry[0] = game.legal_moves(state)
+        return moves
+
+    def score(self, state, evaluator, evaluate):
+        """ evaluate(player to move) for state, remembered under evaluator.
+        """
+        with self.lock:
+            entry = self.entry(state)
+            if entry[1] is evaluator:
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        value = evaluate(state.player)
+        with self.lock:
+            entry[1], entry[2] = evaluator, value
+        return value
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else None
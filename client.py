@@ -0,0 +1,106 @@
+""" Plays games on a match server (see server.py for the protocol).
+
+    python client.py --opponent alphabeta --agent rng
+    python client.py --opponent remote --agent self --verbose
+    python client.py --opponent rng --games 200
+
+    The client keeps its own copy of the game from the server's
+    messages and asks a local agent, any of runner.py's, for its moves.
+    --agent self is a human at the keyboard. --games N plays N games at
+    once over separate connections, to load the server.
+"""
+import argparse
+import asyncio
+
+from reversi import Reversi, move_repr, parse_move
+from bitboard import BitReversi
+from match import AGENT_NAMES, build_agent
+
+# seconds of the move time left for the network
+MARGIN = 0.5
+
+
+async def play(host, port, opponent, size, name, options, verbose=False):
+    """ Plays one game, returns the server's END message as words.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    loop = asyncio.get_running_loop()
+
+    async def send(text):
+        writer.write((text + "\n").encode("ascii"))
+        await writer.drain()
+
+    await send("PLAY {} {}".format(opponent, size))
+    game = state = agent = None
+    sent = None
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return ["END", "disconnected"]
+            words = line.decode("ascii").split()
+            if words[0] == "ILLEGAL":
+                print("server refused {}".format(words[1]))
+                words = ["TURN", seconds]
+                sent = None
+            elif sent is not None:
+                # any other answer means our move was taken
+                state = game.make_move(state, sent)
+                sent = None
+
+            if words[0] == "GAME":
+                w, h = map(int, words[3].split("x"))
+                game = BitReversi() if (w, h) == (8, 8) else Reversi(h, w)
+                state = game.initial_state()
+                agent = build_agent(name, options)
+                if verbose:
+                    print("game {} as {}".format(words[1], words[2]))
+            elif words[0] == "MOVED":
+                state = game.make_move(state, parse_move(words[1]))
+            elif words[0] == "TURN":
+                seconds = float(words[1])
+                if verbose:
+                    game.print_board(state)
+                sent = await loop.run_in_executor(None, agent.next_move, game, state,
+                                                  max(seconds - MARGIN, 0.1))
+                await send(move_repr(sent))
+            elif words[0] in ("END", "ERROR"):
+                return words
+    finally:
+        if agent is not None and hasattr(agent, "close"):
+            agent.close()
+        writer.close()
+
+
+async def play_many(args):
+    options = {"depth": args.depth, "iterative": args.iterative}
+    games = [play(args.host, args.port, args.opponent, args.size, args.agent, options, args.verbose)
+             for _ in range(args.games)]
+    return await asyncio.gather(*games)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play Reversi on a match server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--opponent", help="built-in agent or remote", default="alphabeta")
+    parser.add_argument("--agent", choices=AGENT_NAMES, help="who plays here", default="rng")
+    parser.add_argument("--size", help="board size", default="8x8")
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--iterative", help="search until the move time is spent", action="store_true")
+    parser.add_argument("--games", help="play N games at once", type=int, default=1)
+    parser.add_argument("--verbose", help="print the board before each move", action="store_true")
+    args = parser.parse_args()
+
+    results = asyncio.run(play_many(args))
+    outcomes = {}
+    for words in results:
+        print(" ".join(words))
+        outcome = words[1] if words[0] == "END" else "refused"
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    if args.games > 1:
+        print(", ".join("{} {}".format(count, outcome) for outcome, count in sorted(outcomes.items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+""" Position database.
+
+    python database.py build games.bin --output positions.bin
+    python database.py lookup positions.bin 5d 6d 6c
+    python database.py range positions.bin --empties 20 24 --corner-move
+
+    Every position of the recorded 8x8 games (see records.py), folded
+    to its canonical symmetric image from the side to move as in the
+    opening book, with how the games through it ended. The file is a
+    sorted array of fixed-size records searched by bisection over an
+    mmap, so it opens instantly, is shared between processes and never
+    has to fit in memory.
+
+    Records are sorted by a 64-bit key: the number of empty squares in
+    the top byte and a hash of the position below it. A position is
+    found by bisecting for its key, and every position with a given
+    number of empties is one contiguous run that range() streams.
+
+    Record: key, own discs, opponent discs, games, wins and draws for
+    the side to move, the sum of the final disc differentials, and the
+    numbers (in the order built) of the first GAMES_KEPT games that
+    reached the position. Every game is counted, but a position reached
+    by more games lists only the lowest numbers, so records stay fixed
+    size.
+
+    Building sorts positions in runs of --run-size in memory, writes
+    each run to a temporary file and merges the runs, and the database
+    being extended with --merge, in one streaming pass.
+"""
+import argparse
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+from collections import namedtuple
+
+from reversi import BLACK, WHITE, parse_move
+from bitboard import (BitReversi, FULL, BITS, canonical, moves_mask, popcount,
+                      to_bits)
+from records import read_games
+
+# game numbers listed per position, unused slots hold NO_GAME
+GAMES_KEPT = 8
+NO_GAME = 0xFFFFFFFF
+RECORD = struct.Struct("<QQQIIIq{}I".format(GAMES_KEPT))
+HASH_BITS = 56
+HASH_MASK = (1 << HASH_BITS) - 1
+CORNERS = BITS[1, 1] | BITS[1, 8] | BITS[8, 1] | BITS[8, 8]
+# positions sorted in memory before they go to a run file
+RUN_SIZE = 1000000
+# reads while streaming a file
+CHUNK = 4096
+
+
+class Entry(namedtuple("Entry", "own opp games wins draws discs reached")):
+    """ A stored position and its outcomes, for the side to move.
+        reached is the lowest numbers of the games through it, at most
+        GAMES_KEPT of them.
+    """
+    __slots__ = ()
+
+    @property
+    def losses(self):
+        return self.games - self.wins - self.draws
+
+    @property
+    def empties(self):
+        return 64 - popcount(self.own | self.opp)
+
+    def score(self):
+        """ Share of the points the side to move took, draws half.
+        """
+        return (self.wins + 0.5 * self.draws) / self.games
+
+    def mean_discs(self):
+        return float(self.discs) / self.games
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(*record[1:7], reached=tuple(n for n in record[7:] if n != NO_GAME))
+
+
+def position_key(own, opp):
+    """ Empty squares in the top byte, a hash of the discs below.
+    """
+    h = (own * 0x9E3779B97F4A7C15 ^ opp * 0xC2B2AE3D27D4EB4F) & FULL
+    h = ((h ^ h >> 31) * 0xBF58476D1CE4E5B9) & FULL
+    h ^= h >> 29
+    return (64 - popcount(own | opp)) << HASH_BITS | (h & HASH_MASK)
+
+
+def empties_range(low, high):
+    """ Keys of positions with low to high empty squares.
+    """
+    return low << HASH_BITS, (high + 1) << HASH_BITS
+
+
+def game_positions(game, moves):
+    """ Yields every position of one game up to the first where neither
+        side can move, which the closing passes of a recorded game
+        would otherwise repeat.
+    """
+    state = game.initial_state()
+    for move in moves:
+        yield state
+        own, opp = to_bits(game, state)
+        if not moves_mask(own, opp) | moves_mask(opp, own):
+            return
+        state = game.make_move(state, move)
+    yield state
+
+
+def outcomes(path, first=0):
+    """ Yields records (key, own, opp, 1, win, draw, discs, game
+        number, unused slots) per position of every 8x8 game in the
+        records file, game numbers counted from first.
+    """
+    game = BitReversi()
+    number = first
+    for w, h, moves in read_games(path):
+        if (w, h) != (8, 8) or not moves:
+            continue
+        states = list(game_positions(game, moves))
+        final = states[-1]
+        black = game.score_player(final, BLACK) - game.score_player(final, WHITE)
+        for state in states:
+            own, opp, _ = canonical(*to_bits(game, state))
+            discs = black if state.player == BLACK else -black
+            yield (position_key(own, opp), own, opp, 1, int(discs > 0), int(discs == 0),
+                   discs, number) + (NO_GAME,) * (GAMES_KEPT - 1)
+        number += 1
+
+
+def combine(a, b):
+    """ Two records of the same position as one, keeping the lowest
+        game numbers of both.
+    """
+    reached = sorted(a[7:] + b[7:])[:GAMES_KEPT]
+    return (a[0], a[1], a[2], a[3] + b[3], a[4] + b[4], a[5] + b[5], a[6] + b[6]) + tuple(reached)
+
+
+def write_run(records, directory):
+    """ Sorts and combines records into a temporary run file, returns
+        its path.
+    """
+    merged = {}
+    for record in records:
+        position = record[:3]
+        merged[position] = combine(merged[position], record) if position in merged else record
+    handle, path = tempfile.mkstemp(suffix=".run", dir=directory)
+    with os.fdopen(handle, "wb") as out:
+        for position in sorted(merged):
+            out.write(RECORD.pack(*merged[position]))
+    return path
+
+
+def read_records(path):
+    """ Streams the records of a run or database file.
+    """
+    with open(path, "rb") as source:
+        while True:
+            data = source.read(RECORD.size * CHUNK)
+            if not data:
+                return
+            for offset in range(0, len(data), RECORD.size):
+                yield RECORD.unpack_from(data, offset)
+
+
+def merge(paths, output):
+    """ Merges sorted record files into output, combining records of
+        the same position. Returns the number of positions written.
+    """
+    count = 0
+    current = None
+    with open(output + ".tmp", "wb") as out:
+        for record in heapq.merge(*[read_records(path) for path in paths]):
+            if current is not None and record[:3] == current[:3]:
+                current = combine(current, record)
+                continue
+            if current is not None:
+                out.write(RECORD.pack(*current))
+                count += 1
+            current = record
+        if current is not None:
+            out.write(RECORD.pack(*current))
+            count += 1
+    os.rename(output + ".tmp", output)
+    return count
+
+
+def build(paths, output, merge_existing=False, run_size=RUN_SIZE):
+    """ Database of every position in the records files, added to the
+        existing output if merge_existing. Returns the number of
+        positions.
+    """
+    runs = []
+    directory = os.path.dirname(os.path.abspath(output))
+    first = 0
+    if merge_existing and os.path.exists(output):
+        runs.append(output)
+        with PositionDatabase(output) as existing:
+            first = existing.games()
+    buffered = []
+    try:
+        for path in paths:
+            for record in outcomes(path, first):
+                buffered.append(record)
+                first = max(first, record[7] + 1)
+                if len(buffered) >= run_size:
+                    runs.append(write_run(buffered, directory))
+                    buffered = []
+        if buffered:
+            runs.append(write_run(buffered, directory))
+        return merge(runs, output)
+    finally:
+        for run in runs:
+            if run != output:
+                os.remove(run)
+
+
+class PositionDatabase:
+    """ Read-only view of a database file.
+    """
+
+    def __init__(self, path):
+        # worker processes open their own view from the path
+        self.path = path
+        self.size = os.path.getsize(path) // RECORD.size
+        self.file = open(path, "rb")
+        self.data = None
+        if self.size:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    def record(self, index):
+        return RECORD.unpack_from(self.data, index * RECORD.size)
+
+    def bisect(self, key):
+        """ Index of the first record whose key is at least key.
+        """
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.record(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, own, opp):
+        """ Entry for the canonical position, or None.
+        """
+        key = position_key(own, opp)
+        index = self.bisect(key)
+        while index < self.size:
+            record = self.record(index)
+            if record[0] != key:
+                return None
+            if record[1:3] == (own, opp):
+                return Entry.from_record(record)
+            index += 1
+        return None
+
+    def lookup(self, game, state):
+        """ Entry for state of an 8x8 game, either engine, or None.
+        """
+        if (game.w, game.h) != (8, 8):
+            return None
+        own, opp, _ = canonical(*to_bits(game, state))
+        return self.find(own, opp)
+
+    def range(self, low, high):
+        """ Streams the entries with low to high empty squares, fewest
+            empties first.
+        """
+        start, stop = empties_range(low, high)
+        index = self.bisect(start)
+        while index < self.size:
+            record = self.record(index)
+            if record[0] >= stop:
+                return
+            yield Entry.from_record(record)
+            index += 1
+
+    def games(self):
+        """ Number of games the database was built from, the games
+            through the initial position.
+        """
+        entry = self.lookup(BitReversi(), BitReversi().initial_state())
+        return entry.games if entry else 0
+
+
+def describe(entry):
+    more = " ..." if entry.games > len(entry.reached) else ""
+    return "{} games, {} wins {} draws {} losses for the side to move ({:0.1f}%, {:+0.1f} discs), games {}{}".format(
+        entry.games, entry.wins, entry.draws, entry.losses, 100.0 * entry.score(),
+        entry.mean_discs(), " ".join(str(number) for number in entry.reached), more)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query a Reversi position database.")
+    commands = parser.add_subparsers(dest="command")
+    builder = commands.add_parser("build", help="add the positions of records files")
+    builder.add_argument("records", nargs="+", help="records files, .bin for binary")
+    builder.add_argument("--output", default="positions.bin")
+    builder.add_argument("--merge", help="add to the existing database instead of replacing it", action="store_true")
+    builder.add_argument("--run-size", type=int, dest="run_size", default=RUN_SIZE)
+    finder = commands.add_parser("lookup", help="outcomes of the position after moves")
+    finder.add_argument("database")
+    finder.add_argument("moves", nargs="*", help="moves from the start, 5d 6d ...")
+    ranger = commands.add_parser("range", help="list positions by empty squares")
+    ranger.add_argument("database")
+    ranger.add_argument("--empties", nargs=2, type=int, default=[0, 60])
+    ranger.add_argument("--corner-move", help="only where the side to move can take a corner", action="store_true", dest="corner_move")
+    ranger.add_argument("--min-games", type=int, dest="min_games", default=1)
+    ranger.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        count = build(args.records, args.output, args.merge, args.run_size)
+        print("wrote {} positions to {}".format(count, args.output))
+    elif args.command == "lookup":
+        game = BitReversi()
+        state = game.initial_state()
+        for text in args.moves:
+            state = game.make_move(state, parse_move(text))
+        with PositionDatabase(args.database) as database:
+            entry = database.lookup(game, state)
+        print(describe(entry) if entry else "not in the database")
+    elif args.command == "range":
+        shown = matched = 0
+        with PositionDatabase(args.database) as database:
+            for entry in database.range(*args.empties):
+                if entry.games < args.min_games:
+                    continue
+                if args.corner_move and not moves_mask(entry.own, entry.opp) & CORNERS:
+                    continue
+                matched += 1
+                if shown < args.limit:
+                    shown += 1
+                    print("{:016x} {:016x} {} empties: {}".format(entry.own, entry.opp, entry.empties,
+                                                                  describe(entry)))
+        print("{} positions".format(matched))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import time
+
+from reversi import EMPTY, BLACK, opponent
+from search import SearchTimeout
+from stability import StabilityAnalyzer, board_masks
+
+# below this many empties ordering by mobility costs more than it saves
+FASTEST_FIRST_EMPTIES = 7
+# likewise for the stable disc bound
+STABILITY_EMPTIES = 8
+
+
+class EndgameSolver:
+    """ Perfect play for the last empty squares.
+
+        Negamax with alpha-beta on the final disc differential for the
+        side to move. Moves into regions (board quadrants) with an odd
+        number of empties are tried first, and with enough empties left
+        moves are ordered fastest-first, by how few replies they leave
+        the opponent. The opponent's stable discs bound the best score
+        reachable, a node whose bound is at most alpha is cut without
+        searching it. With wld=True only win/loss/draw is proven, which
+        is a null-window search and much cheaper.
+    """
+
+    def __init__(self):
+        self.nodes = 0
+
+    def solve(self, game, state, deadline, wld=False):
+        """ (score, best move) for the player to move in state, score is
+            final disc differential, or -1/0/1 with wld. Raises
+            SearchTimeout at deadline, state is left modified then.
+        """
+        self.game = game
+        self.deadline = deadline
+        self.half_w = (game.w + 1) // 2
+        self.half_h = (game.h + 1) // 2
+        self.stability = StabilityAnalyzer(game.w, game.h)
+        self.regions = {}
+        empties = 0
+        for x in range(1, game.w + 1):
+            for y in range(1, game.h + 1):
+                if game.owner(state, (x, y)) == EMPTY:
+                    region = self.region((x, y))
+                    self.regions[region] = self.regions.get(region, 0) + 1
+                    empties += 1
+
+        limit = game.w * game.h + 1
+        a, b = (-1, 1) if wld else (-limit, limit)
+        score, move = self.negamax(state, empties, a, b)
+        if wld:
+            score = (score > 0) - (score < 0)
+        return score, move
+
+    def region(self, move):
+        x, y = move
+        return (x > self.half_w, y > self.half_h)
+
+    def final_score(self, state):
+        player = state.player
+        return (self.game.score_player(state, player)
+                - self.game.score_player(state, opponent(player)))
+
+    def order(self, state, moves, empties):
+        regions = self.regions
+        even = lambda move: regions[self.region(move)] % 2 == 0
+        if empties <= FASTEST_FIRST_EMPTIES:
+            return sorted(moves, key=even)
+
+        game = self.game
+        keyed = []
+        for move in moves:
+            record = game.apply(state, move)
+            keyed.append((len(game.legal_moves(state)), even(move), move))
+            game.undo(state, record)
+        keyed.sort(key=lambda key: key[:2])
+        return [move for _, _, move in keyed]
+
+    def negamax(self, state, empties, a, b):
+        """ (score, move), fail-soft.
+        """
+        self.nodes += 1
+        if time.time() >= self.deadline:
+            raise SearchTimeout()
+
+        game = self.game
+        moves = game.legal_moves(state)
+        if not moves:
+            record = game.apply(state, "pass")
+            if not game.legal_moves(state):
+                game.undo(state, record)
+                return self.final_score(state), "pass"
+            score, _ = self.negamax(state, empties, -b, -a)
+            game.undo(state, record)
+            return -score, "pass"
+
+        if empties >= STABILITY_EMPTIES:
+            black, white = board_masks(game, state)
+            own, opp = (black, white) if state.player == BLACK else (white, black)
+            bound = self.stability.upper_bound(own, opp)
+            if bound <= a:
+                return bound, moves[0]
+
+        best_score = None
+        best_move = moves[0]
+        for move in self.order(state, moves, empties):
+            region = self.region(move)
+            self.regions[region] -= 1
+            record = game.apply(state, move)
+            score, _ = self.negamax(state, empties - 1, -b, -a)
+            score = -score
+            game.undo(state, record)
+            self.regions[region] += 1
+
+            if best_score is None or score > best_score:
+                best_score = score
+                best_move = move
+                if score > a:
+                    a = score
+                    if a >= b:
+                        break
+        return best_score, best_move
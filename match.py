@@ -0,0 +1,222 @@
+""" Playing games as a library.
+
+    from match import play_match, build_agent
+    from reversi import Reversi
+
+    agents = [build_agent("alphabeta", {"depth": 4}), build_agent("rng")]
+    state, moves, records = play_match(Reversi(), agents, timeout=10)
+
+    Nothing is printed unless an observer does it. Agents are imported
+    the first time build_agent needs them, so importing this module only
+    loads the engine.
+"""
+import json
+import time
+
+from reversi import move_repr
+
+AGENT_NAMES = ["rng", "minmax", "alphabeta", "mcts", "self"]
+
+
+def build_agent(name, options=None):
+    """ Agent from its runner name. options takes the runner's option
+        names (depth, iterative, game_time, tt_size, workers, endgame,
+        book, weights, rollouts, timing, ponder, cache, cache_size,
+        database),
+        missing ones default.
+    """
+    options = options or {}
+    get = options.get
+    if name == "rng" or not name:
+        from agents import RandomAgent
+        agent = RandomAgent()
+    elif name == "minmax":
+        from agents import MinMaxAgent
+        agent = MinMaxAgent(get("depth", 4), get("iterative", False), get("game_time"),
+                            position_cache(options))
+    elif name == "alphabeta":
+        from agents import AlphaBetaAgent
+        book = weights = None
+        if get("book"):
+            from book import OpeningBook
+            book = OpeningBook(get("book"))
+        if get("weights"):
+            from patterns import load_weights
+            weights = load_weights(get("weights"))
+        agent = AlphaBetaAgent(get("depth", 4), get("tt_size", 16), get("iterative", False),
+                               get("game_time"), get("workers", 1), get("endgame", 0),
+                               book, weights, position_cache(options))
+    elif name == "mcts":
+        from agents import MCTSAgent
+        database = None
+        if get("database"):
+            from database import PositionDatabase
+            database = PositionDatabase(get("database"))
+        agent = MCTSAgent(get("rollouts", 8), get("workers", 1), game_time=get("game_time"),
+                          database=database)
+    elif name == "self":
+        from agents import InteractiveAgent
+        agent = InteractiveAgent()
+    else:
+        raise ValueError("unknown agent {}".format(name))
+    agent.timing = get("timing", False)
+    agent.pondering = get("ponder", False)
+    return agent
+
+
+def position_cache(options):
+    """ The PositionCache in options, to share one between agents, or a
+        new one holding cache_size positions.
+    """
+    if options.get("cache") is not None:
+        return options["cache"]
+    from cache import PositionCache
+    return PositionCache(options.get("cache_size", 100000))
+
+
+def move_record(state, agent, move, seconds):
+    """ What happened on one move, JSON friendly.
+    """
+    return {
+        "turn": state["turn"],
+        "player": state["player"],
+        "agent": type(agent).__name__,
+        "move": move_repr(move),
+        "time": seconds,
+        "stats": getattr(agent, "stats", None)
+    }
+
+
+def play_match(game, agents, timeout, observers=(), state=None):
+    """ Plays agents against each other, first one as black, until
+        every agent passes in the same round. Tells agents about each
+        other's moves (opponent_moved, ponder) and observers about
+        everything. Returns the final state, the moves and a
+        move_record per move. Starts from state if given, the first
+        agent then plays the player to move.
+    """
+    if state is None:
+        state = game.initial_state()
+    moves = []
+    records = []
+    for observer in observers:
+        observer.start(game, state)
+    while True:
+        passes = 0
+        for agent in agents:
+            time1 = time.time()
+            move = agent.next_move(game, state, timeout)
+            seconds = time.time() - time1
+            new_state = game.make_move(state, move)
+            for other in agents:
+                if other is not agent and hasattr(other, "opponent_moved"):
+                    other.opponent_moved(game, state, move)
+            if hasattr(agent, "ponder"):
+                agent.ponder(game, new_state)
+
+            record = move_record(state, agent, move, seconds)
+            records.append(record)
+            moves.append(move)
+            for observer in observers:
+                observer.moved(game, state, move, new_state, record)
+            state = new_state
+            if move == "pass":
+                passes += 1
+        if passes == len(agents):
+            break
+    for observer in observers:
+        observer.finished(game, state, moves, records)
+    return state, moves, records
+
+
+class Observer:
+    """ Does nothing, override what you need.
+    """
+
+    def start(self, game, state):
+        pass
+
+    def moved(self, game, state, move, new_state, record):
+        pass
+
+    def finished(self, game, state, moves, records):
+        pass
+
+
+class BoardPrinter(Observer):
+
+    def start(self, game, state):
+        game.print_board(state)
+
+    def moved(self, game, state, move, new_state, record):
+        game.print_board(new_state)
+
+
+class MovePrinter(Observer):
+    """ Moves in YX format, as move_repr prints them.
+    """
+
+    def moved(self, game, state, move, new_state, record):
+        print(move_repr(move))
+
+
+class StatsPrinter(Observer):
+    """ Turn time, score and the agent's search stats after every move.
+    """
+
+    def moved(self, game, state, move, new_state, record):
+        print("Turn {} for player {} took {:0.3f} ms, {} score".format(
+            state["turn"], state["player"], record["time"] * 1000.0,
+            game.score_player(new_state, state["player"])))
+        print_stats(record["stats"])
+
+
+def print_stats(stats):
+    if not stats:
+        return
+    print("  {} nodes, {} leaves, {:0.0f} nodes/s, depth {}, {} workers, time to depth {}".format(
+        stats["nodes"], stats["leaves"], stats["nps"], stats["depth"], stats["workers"],
+        ' '.join('{}:{:0.3f}s'.format(d, t) for d, t in stats["depth_times"])))
+    if stats["branching"] is not None:
+        print("  effective branching factor {:0.2f}".format(stats["branching"]))
+    if stats.get("first_cutoff_rate") is not None:
+        print("  {} cutoffs, {:0.1f}% on the first move".format(
+            stats["cutoffs"], 100.0 * stats["first_cutoff_rate"]))
+    if stats.get("cache_hits") is not None:
+        lookups = stats["cache_hits"] + stats["cache_misses"]
+        print("  position cache {} hits, {} misses ({:0.1f}%)".format(
+            stats["cache_hits"], stats["cache_misses"],
+            100.0 * stats["cache_hits"] / lookups if lookups else 0.0))
+    if stats.get("ponder_hit") is not None:
+        print("  ponder {} after depth {}".format("hit" if stats["ponder_hit"] else "miss", stats["ponder_depth"]))
+    if stats["phase_times"] is not None:
+        phases = stats["phase_times"]
+        other = stats["time"] - sum(phases.values())
+        print("  " + ", ".join("{} {:0.3f}s".format(phase, seconds)
+                               for phase, seconds in sorted(phases.items()) + [("other", other)]))
+
+
+class StatsWriter(Observer):
+    """ Appends the move records as JSON lines to path when the game ends.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def finished(self, game, state, moves, records):
+        with open(self.path, "a") as out:
+            for record in records:
+                out.write(json.dumps(record) + "\n")
+
+
+class Archive(Observer):
+    """ Appends the game's moves to a records file (see records.py).
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def finished(self, game, state, moves, records):
+        from records import RecordWriter
+        with RecordWriter(self.path) as archive:
+            archive.write(game, moves)
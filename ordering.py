@@ -0,0 +1,90 @@
+def static_table(w, h):
+    """ Positional value of every square on a w x h board: corners
+        best, the squares next to them worst, edges good. On 8x8 this
+        is the table AlphaBetaAgent used to hard-code.
+    """
+    table = {}
+    for x in range(1, w + 1):
+        for y in range(1, h + 1):
+            dx = min(x - 1, w - x)
+            dy = min(y - 1, h - y)
+            near, far = min(dx, dy), max(dx, dy)
+            if near == 0:
+                value = 4 if far == 0 else -3 if far == 1 else 2
+            elif near == 1:
+                value = -4 if far == 1 else -1
+            else:
+                value = 1 if dx == dy else 0
+            table[x, y] = value
+    return table
+
+
+class MoveOrderer:
+    """ Orders moves for alpha-beta: the transposition table (or
+        previous iteration's) best move, then killer moves that caused
+        a cutoff at the same ply, then by history score plus the static
+        positional table. History persists across turns and is halved
+        at the start of each search so old results fade.
+    """
+    KILLERS = 2
+    KILLER_BONUS = 1 << 30
+
+    def __init__(self, w, h):
+        self.w = w
+        self.h = h
+        self.static = static_table(w, h)
+        self.history = dict((move, 0) for move in self.static)
+        self.killers = []
+        self.cutoffs = 0
+        self.first_cutoffs = 0
+
+    def new_search(self):
+        for move in self.history:
+            self.history[move] //= 2
+        self.killers = []
+        self.reset_counts()
+
+    def reset_counts(self):
+        """ Cutoff counts only, killers and history stay.
+        """
+        self.cutoffs = 0
+        self.first_cutoffs = 0
+
+    def order(self, moves, ply, tt_move=None):
+        while len(self.killers) <= ply:
+            self.killers.append([])
+        killers = self.killers[ply]
+        history = self.history
+        static = self.static
+
+        def score(move):
+            if move in killers:
+                return self.KILLER_BONUS - killers.index(move)
+            return history[move] + static[move]
+
+        ordered = sorted(moves, key=score, reverse=True)
+        if tt_move in moves:
+            ordered.remove(tt_move)
+            ordered.insert(0, tt_move)
+        return ordered
+
+    def cutoff(self, move, ply, depth, index):
+        """ move, the index-th one tried, caused a cutoff at ply with
+            depth plies left to search.
+        """
+        self.cutoffs += 1
+        if index == 0:
+            self.first_cutoffs += 1
+        if move == "pass":
+            return
+        self.history[move] += depth * depth
+        killers = self.killers[ply]
+        if move in killers:
+            killers.remove(move)
+        killers.insert(0, move)
+        del killers[self.KILLERS:]
+
+    def first_cutoff_rate(self):
+        """ Share of cutoffs caused by the first move tried.
+        """
+        return float(self.first_cutoffs) / self.cutoffs if self.cutoffs else None
@@ -0,0 +1,238 @@
+""" Pattern evaluation.
+
+    The board is cut into lines and regions (edges, the 3x3 corner
+    regions and the two long diagonals). Each configuration of a pattern
+    is a base 3 number (0 empty, 1 black, 2 white per square) indexing a
+    precomputed table of scores, all from black's point of view. Symmetric
+    instances share one table, so the four edges all use "edge8" on 8x8.
+
+    PatternEvaluator keeps the index of every instance up to date as
+    discs are placed and flipped, so a leaf costs one table lookup per
+    instance instead of rescanning the board. It also keeps the discs
+    as masks, adds a weight per stable disc (see stability.py) and, on
+    8x8, a weight per move black has more than white, counted from the
+    same masks with the bitboard move generator.
+
+    Weights are JSON, {"patterns": {kind: [3 ** length scores],
+    "stability": weight, "mobility": weight}}; kinds missing from the
+    file use the hand-written defaults below.
+"""
+import json
+
+from reversi import EMPTY, BLACK, WHITE
+from bitboard import popcount, moves_mask
+from stability import StabilityAnalyzer
+
+DIGIT = {EMPTY: 0, BLACK: 1, WHITE: 2}
+SIGN = [0, 1, -1]
+# longer lines would need tables of 3 ** length entries
+MAX_LENGTH = 10
+# per stable disc, on top of what the patterns give it
+STABILITY = 4.0
+# per move more than the opponent has
+MOBILITY = 2.0
+
+
+def square_index(w, h, x, y):
+    """ Squares number x-major from 0, like legal_moves and the bitboard.
+    """
+    return (x - 1) * h + (y - 1)
+
+
+def instances(w, h):
+    """ [(kind, [square indices])] for a w x h board. Squares are listed
+        from a corner outwards so symmetric instances line up.
+    """
+    found = []
+    if w >= 3 and h >= 3:
+        for cx, cy, sx, sy in [(1, 1, 1, 1), (w, 1, -1, 1), (1, h, 1, -1), (w, h, -1, -1)]:
+            found.append(("corner", [square_index(w, h, cx + sx * i, cy + sy * j)
+                                     for j in range(3) for i in range(3)]))
+    if w <= MAX_LENGTH:
+        for y in (1, h):
+            found.append(("edge{}".format(w), [square_index(w, h, x, y) for x in range(1, w + 1)]))
+    if h <= MAX_LENGTH:
+        for x in (1, w):
+            found.append(("edge{}".format(h), [square_index(w, h, x, y) for y in range(1, h + 1)]))
+    n = min(w, h)
+    if n <= MAX_LENGTH:
+        found.append(("diag{}".format(n), [square_index(w, h, 1 + k, 1 + k) for k in range(n)]))
+        found.append(("diag{}".format(n), [square_index(w, h, w - k, 1 + k) for k in range(n)]))
+    return found
+
+
+def digits(index, length):
+    """ Per square digits of a configuration index.
+    """
+    out = []
+    for _ in range(length):
+        index, digit = divmod(index, 3)
+        out.append(digit)
+    return out
+
+
+def anchored(signs):
+    """ Discs in one colour run from the first square, signed, not
+        counting the first square itself.
+    """
+    if not signs[0]:
+        return 0
+    run = 0
+    for sign in signs[1:]:
+        if sign != signs[0]:
+            break
+        run += sign
+    return run
+
+
+def score_corner(signs):
+    """ Corner owned is worth a lot, while it is empty the C and X
+        squares next to it hand it to the opponent.
+    """
+    if signs[0]:
+        return 25.0 * signs[0]
+    return -12.5 * (signs[1] + signs[3] + signs[4])
+
+
+def score_edge(signs):
+    """ Discs anchored to an owned corner can't be flipped, A and B
+        squares are good, corners and C squares are left to "corner".
+    """
+    n = len(signs)
+    value = 5.0 * anchored(signs)
+    if not signs[0] or any(sign != signs[0] for sign in signs):
+        value += 5.0 * anchored(signs[::-1])
+    value += 2.0 * sum(signs[2:n - 2])
+    return value
+
+
+def score_diagonal(signs):
+    value = 3.0 * anchored(signs)
+    if not signs[0] or any(sign != signs[0] for sign in signs):
+        value += 3.0 * anchored(signs[::-1])
+    return value
+
+
+def default_table(kind, length):
+    if kind == "corner":
+        score = score_corner
+    elif kind.startswith("edge"):
+        score = score_edge
+    else:
+        score = score_diagonal
+    return [score([SIGN[digit] for digit in digits(index, length)])
+            for index in range(3 ** length)]
+
+
+def load_weights(path):
+    with open(path) as source:
+        return json.load(source)["patterns"]
+
+
+def save_weights(path, tables):
+    with open(path, "w") as out:
+        json.dump({"patterns": tables}, out)
+
+
+class PatternEvaluator:
+    """ Incrementally updated pattern score of one position. tables is
+        {kind: scores} as from load_weights, None for the defaults.
+    """
+
+    def __init__(self, w, h, tables=None):
+        self.w = w
+        self.h = h
+        self.instances = instances(w, h)
+        tables = dict(tables or {})
+        for kind, squares in self.instances:
+            if kind not in tables:
+                tables[kind] = default_table(kind, len(squares))
+        self.tables = [tables[kind] for kind, _ in self.instances]
+        self.stability = tables.get("stability", STABILITY)
+        # the move masks are 64-bit, other sizes go without
+        self.mobility = tables.get("mobility", MOBILITY) if (w, h) == (8, 8) else 0.0
+        self.analyzer = StabilityAnalyzer(w, h)
+
+        # per square the (instance, place value) pairs it belongs to
+        self.touching = [[] for _ in range(w * h)]
+        for i, (_, squares) in enumerate(self.instances):
+            for place, square in enumerate(squares):
+                self.touching[square].append((i, 3 ** place))
+        self.indices = [0] * len(self.instances)
+        # disc masks by digit, so masks[1] is black
+        self.masks = [0, 0, 0]
+        self.seeds = (0, 0)
+        # empty squares left per line and full lines per axis
+        self.line_empties = []
+        self.full = [0, 0, 0, 0]
+
+    def reset(self, game, state):
+        """ Indices from scratch for state.
+        """
+        self.indices = [0] * len(self.instances)
+        self.masks = [0, 0, 0]
+        for x in range(1, self.w + 1):
+            for y in range(1, self.h + 1):
+                digit = DIGIT[game.owner(state, (x, y))]
+                if digit:
+                    square = square_index(self.w, self.h, x, y)
+                    self.masks[digit] |= 1 << square
+                    for i, place in self.touching[square]:
+                        self.indices[i] += digit * place
+        occupied = self.masks[1] | self.masks[2]
+        self.line_empties = [bin(line & ~occupied).count("1")
+                             for _, line in self.analyzer.line_masks]
+        self.full = self.analyzer.full_lines(occupied)
+        # what is stable now stays stable below in the search
+        self.seeds = self.analyzer.discs(self.masks[1], self.masks[2])
+
+    def update(self, player, square, flipped, sign=1):
+        """ player placed square and flipped, sign -1 takes it back.
+        """
+        if square is None:
+            return
+        indices = self.indices
+        touching = self.touching
+        own = DIGIT[player]
+        placed = sign * own
+        for i, place in touching[square]:
+            indices[i] += placed * place
+        # flipping turns the opponent's digit into player's
+        turned = sign * (own - (3 - own))
+        flips = 0
+        for loc in flipped:
+            flips |= 1 << loc
+            for i, place in touching[loc]:
+                indices[i] += turned * place
+        # xor, so taking a move back is the same operation
+        self.masks[own] ^= flips | 1 << square
+        self.masks[3 - own] ^= flips
+
+        empties = self.line_empties
+        full = self.full
+        line_masks = self.analyzer.line_masks
+        for line in self.analyzer.through[square]:
+            if empties[line] == 0 or empties[line] == sign:
+                axis, mask = line_masks[line]
+                full[axis] ^= mask
+            empties[line] -= sign
+
+    def score(self, player):
+        """ Score of the current position for player.
+        """
+        total = 0.0
+        for table, index in zip(self.tables, self.indices):
+            total += table[index]
+        if self.stability:
+            black, white = self.analyzer.discs(self.masks[1], self.masks[2], self.seeds, self.full)
+            total += self.stability * (popcount(black) - popcount(white))
+        if self.mobility:
+            total += self.mobility * self.mobility_difference()
+        return total if player == BLACK else -total
+
+    def mobility_difference(self):
+        """ Moves black has less the moves white has, as if each were
+            to move.
+        """
+        black, white = self.masks[1], self.masks[2]
+        return popcount(moves_mask(black, white)) - popcount(moves_mask(white, black))
@@ -0,0 +1,190 @@
+""" Game records.
+
+    Games are appended to a file as they finish and read back one at a
+    time, so archives of millions of games never have to fit in memory.
+
+    text:   one game per line, board size then the moves as move_repr
+            prints them: "8x8 5d 6d 6c ... PASS PASS"
+    binary: per game a header (width, height, number of moves) and a
+            byte per move, the square numbered x-major from 0 as in
+            legal_moves, 255 for a pass. Files ending in .bin are binary.
+
+    python records.py games.txt --agent alphabeta --depth 4 --processes 4
+
+    re-searches every recorded position with the agent and reports how
+    often it agrees with the move that was played.
+"""
+import argparse
+import multiprocessing
+import struct
+from itertools import islice
+
+from reversi import Reversi, move_repr, parse_move
+from bitboard import BitReversi
+from match import build_agent
+
+HEADER = struct.Struct("<BBH")
+PASS = 255
+
+
+def is_binary(path):
+    return path.endswith(".bin")
+
+
+def encode_move(move, h):
+    if move == "pass":
+        return PASS
+    x, y = move
+    return (x - 1) * h + (y - 1)
+
+
+def decode_move(index, h):
+    if index == PASS:
+        return "pass"
+    x, y = divmod(index, h)
+    return (x + 1, y + 1)
+
+
+class RecordWriter:
+    """ Appends games to path, text or binary by extension. Each game
+        is flushed as it is written so a crash loses at most one.
+    """
+
+    def __init__(self, path):
+        self.binary = is_binary(path)
+        self.out = open(path, "ab" if self.binary else "a")
+
+    def write(self, game, moves):
+        if self.binary:
+            if game.w * game.h >= PASS:
+                raise ValueError("binary records hold boards of at most 254 squares")
+            self.out.write(HEADER.pack(game.w, game.h, len(moves)))
+            self.out.write(bytearray(encode_move(move, game.h) for move in moves))
+        else:
+            self.out.write("{}x{} {}\n".format(
+                game.w, game.h, " ".join(move_repr(move) for move in moves)))
+        self.out.flush()
+
+    def close(self):
+        self.out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_games(path):
+    """ Yields (w, h, moves) per recorded game.
+    """
+    if is_binary(path):
+        with open(path, "rb") as source:
+            while True:
+                header = source.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                w, h, count = HEADER.unpack(header)
+                data = bytearray(source.read(count))
+                yield w, h, [decode_move(index, h) for index in data]
+    else:
+        with open(path) as source:
+            for line in source:
+                fields = line.split()
+                if not fields:
+                    continue
+                w, h = map(int, fields[0].split("x"))
+                yield w, h, [parse_move(text) for text in fields[1:]]
+
+
+def make_game(w, h, bitboard=False):
+    if bitboard and (w, h) == (8, 8):
+        return BitReversi()
+    return Reversi(h, w)
+
+
+def replay(game, moves):
+    """ Yields (state, move) for every move of a game, state being the
+        position the move was played in.
+    """
+    state = game.initial_state()
+    for move in moves:
+        yield state, move
+        state = game.make_move(state, move)
+
+
+def positions(path, bitboard=False):
+    """ Yields (game number, ply, game, state, move played) for every
+        position in the file, one game in memory at a time.
+    """
+    games = {}
+    for number, (w, h, moves) in enumerate(read_games(path)):
+        if (w, h) not in games:
+            games[w, h] = make_game(w, h, bitboard)
+        game = games[w, h]
+        for ply, (state, move) in enumerate(replay(game, moves)):
+            yield number, ply, game, state, move
+
+
+# one agent per pool process, reused for every position it is given
+_analyst = None
+
+def analyze_position(task):
+    global _analyst
+    number, ply, game, state, played, name, options = task
+    if _analyst is None:
+        _analyst = build_agent(name, options)
+    agent = _analyst
+    move = agent.next_move(game, state, options["timeout"])
+    stats = getattr(agent, "stats", None) or {}
+    return number, ply, played, move, stats.get("value")
+
+
+def analyze(path, name, options, processes=None, chunk=1000):
+    """ Yields (game number, ply, move played, agent's move, agent's
+        value) for every position in path, searched by the named agent
+        (see match.build_agent) over a process pool. Positions
+        are handed out chunk at a time so memory stays bounded.
+    """
+    tasks = ((number, ply, game, state, move, name, options)
+             for number, ply, game, state, move in positions(path, options.get("bitboard")))
+    pool = multiprocessing.Pool(processes)
+    try:
+        while True:
+            batch = list(islice(tasks, chunk))
+            if not batch:
+                return
+            for result in pool.imap(analyze_position, batch):
+                yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-analyze recorded Reversi games.")
+    parser.add_argument("path", help="records file, .bin for binary")
+    parser.add_argument("--agent", choices=["rng", "minmax", "alphabeta", "mcts"], default="alphabeta")
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--timeout", type=int, default=60)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--bitboard", help="replay 8x8 games on the bitboard engine", action="store_true")
+    parser.add_argument("--verbose", help="print every position", action="store_true")
+    args = parser.parse_args()
+
+    options = {"depth": args.depth, "tt_size": 16, "iterative": False, "timeout": args.timeout,
+               "bitboard": args.bitboard}
+    agreed = total = 0
+    for number, ply, played, move, value in analyze(args.path, args.agent, options, args.processes):
+        total += 1
+        agreed += move == played
+        if args.verbose:
+            print("game {} ply {}: played {}, {} plays {} ({})".format(
+                number, ply, move_repr(played), args.agent, move_repr(move), value))
+    if total:
+        print("{} positions, {} agrees with {:0.1f}% of the moves played".format(
+            total, args.agent, 100.0 * agreed / total))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
 from string import ascii_lowercase
+import random
 import time
 from operator import sub
 from sys import version_info, stdout
+from position import BoardPosition
 
 EMPTY, BLACK, WHITE, BORDER = ' ', 'O', 'X', '#'
 
+# a BoardPosition's board holds these codes, one byte per point
+MARKERS = [EMPTY, BLACK, WHITE, BORDER]
+CODE = dict((marker, code) for code, marker in enumerate(MARKERS))
+
 def move_repr(move):
     """ XY where X is row and Y is column, or PASS
     """
@@ -16,15 +22,31 @@ def move_repr(move):
     repr += ascii_lowercase[x-1]
     return repr
 
+def parse_move(text):
+    """ Inverse of move_repr, "5d" is (4, 5)
+    """
+    if text.upper() == "PASS":
+        return "pass"
+
+    return ascii_lowercase.index(text[-1].lower()) + 1, int(text[:-1])
+
+def zobrist_keys(count, seed=0x5EED):
+    """ count random 64-bit keys, the same on every run so
+        hashes can be shared between processes and files.
+    """
+    rng = random.Random(seed)
+    return [rng.getrandbits(64) for _ in range(count)]
+
 def opponent(player):
     return BLACK if player == WHITE else WHITE
 
 def mark_line(board, player, src, dir, end):
     """ Change ownership of markers from src to end.
     """
+    code = CODE[player]
     src += dir
     while src != end:
-        board[src] = player
+        board[src] = code
         src += dir
 
 def raycast(state, src, dir):
@@ -32,9 +54,9 @@ def raycast(state, src, dir):
         if current player has a mark with
         at least one enemy in between.
     """
-    player = state["player"]
+    player = CODE[state["player"]]
     board = state["board"]
-    enemy = opponent(player)
+    enemy = 3 - player
     loc = src + dir
 
     # Fail if surrounded by self
@@ -64,20 +86,62 @@ class Reversi:
         self.directions = [self.W, self.E, self.N, self.S,
                            self.SW, self.SE, self.NW, self.NE]
 
+        # zobrist keys per point and colour, plus white to move
+        size = self.w_ * self.h_
+        keys = zobrist_keys(2 * size + 1)
+        self.zobrist = {BLACK: keys[:size], WHITE: keys[size:2 * size]}
+        self.zobrist_side = keys[-1]
+
+        # squares in legal_moves order, and per point the rays that
+        # could flip something (two or more squares before the border)
+        self.squares = [((x, y), self.map_2d(x, y))
+                        for x in range(1, w + 1)
+                        for y in range(1, h + 1)]
+        self.rays = [None] * size
+        self.neighbours = [None] * size
+        self.square_of = [None] * size
+        for square, (_, point) in enumerate(self.squares):
+            self.square_of[point] = square
+        for (x, y), point in self.squares:
+            rays = []
+            for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1),
+                           (-1, 1), (1, 1), (-1, -1), (1, -1)]:
+                ray = []
+                nx, ny = x + dx, y + dy
+                while 0 < nx <= w and 0 < ny <= h:
+                    ray.append(self.map_2d(nx, ny))
+                    nx, ny = nx + dx, ny + dy
+                if len(ray) > 1:
+                    rays.append(tuple(ray))
+            self.rays[point] = rays
+            self.neighbours[point] = [point + dir for dir in self.directions]
 
     def initial_state(self):
         """ Black starts
         """
         center = self.map_2d(int(self.w_ / 2), int(self.h_ / 2))
 
-        board = [BORDER if x % self.w_ == 0 and y % self.h_ == 0 else EMPTY
-                 for x in range(self.w_)
-                 for y in range(self.h_)]
+        board = bytearray(CODE[EMPTY] if 0 < x <= self.w and 0 < y <= self.h else CODE[BORDER]
+                          for y in range(self.h_)
+                          for x in range(self.w_))
+
+        board[center], board[center + self.NW] = CODE[WHITE], CODE[WHITE]
+        board[center + self.W], board[center + self.N] = CODE[BLACK], CODE[BLACK]
 
-        board[center], board[center + self.NW] = WHITE, WHITE
-        board[center + self.W], board[center + self.N] = BLACK, BLACK
+        state = BoardPosition(1, BLACK, board, 0, 2, 2)
+        state.hash = self.hash_state(state)
+        return state
 
-        return {"turn": 1, "player": BLACK, "board": board}
+    def hash_state(self, state):
+        """ Zobrist key of state from scratch, apply() keeps
+            state["hash"] up to date incrementally.
+        """
+        key = self.zobrist_side if state["player"] == WHITE else 0
+        for point, code in enumerate(state["board"]):
+            owner = MARKERS[code]
+            if owner in self.zobrist:
+                key ^= self.zobrist[owner][point]
+        return key
 
     def map_2d(self, x, y):
         return y * self.w_ + x
@@ -87,55 +151,151 @@ class Reversi:
         """
         return self.map_2d(*move)
 
+    def owner(self, state, move):
+        """ Marker at (x, y), BORDER outside the board
+        """
+        return MARKERS[state["board"][self.to_grid(move)]]
+
+    def flips(self, board, player, point):
+        """ Points flipped by player (a code) placing a marker at
+            point, one pass over the precomputed rays.
+        """
+        enemy = 3 - player
+        flipped = []
+        for ray in self.rays[point]:
+            if board[ray[0]] != enemy:
+                continue
+            for i in range(1, len(ray)):
+                owner = board[ray[i]]
+                if owner == player:
+                    flipped.extend(ray[:i])
+                    break
+                if owner != enemy:
+                    break
+        return flipped
+
+    def brackets(self, board, player, point):
+        """ True if a marker of player (a code) at point flips anything.
+        """
+        enemy = 3 - player
+        for ray in self.rays[point]:
+            if board[ray[0]] != enemy:
+                continue
+            for i in range(1, len(ray)):
+                owner = board[ray[i]]
+                if owner == player:
+                    return True
+                if owner != enemy:
+                    break
+        return False
+
     def is_legal_move(self, state, move):
         """ Move is legal if player has marker in any
             direction with at least one enemy cell in
             between.
         """
+        x, y = move
+        if not (0 < x <= self.w and 0 < y <= self.h):
+            return None
         point = self.to_grid(move)
 
-        if state["board"][point] != EMPTY:
+        if state["board"][point] != CODE[EMPTY]:
             return None
 
-        for dir in self.directions:
-            if raycast(state, point, dir):
-                return True
-
-        return False
+        return self.brackets(state["board"], CODE[state["player"]], point)
 
     def legal_moves(self, state):
-        """ Expensive but simple
+        """ Only empty squares next to an enemy marker (the
+            frontier) can be legal, so only those are checked.
         """
-        return [(x, y) for x in range(1, self.w)
-                for y in range(1, self.h)
-                if self.is_legal_move(state, (x, y))]
+        board = state.board
+        player = CODE[state.player]
+        enemy = 3 - player
+
+        frontier = set()
+        for _, point in self.squares:
+            if board[point] == enemy:
+                frontier.update(self.neighbours[point])
+
+        return [move for move, point in self.squares
+                if point in frontier and not board[point]
+                and self.brackets(board, player, point)]
+
+    def copy_state(self, state):
+        return state.copy()
 
     def make_move(self, state, move):
         """ Returns next game state with move applied.
         """
-        board = list(state["board"])
+        state = self.copy_state(state)
+        self.apply(state, move)
+        return state
+
+    def apply(self, state, move):
+        """ Applies move to state in place and returns an undo
+            record (point, flipped points, player, turn, hash).
+        """
+        player = state.player
+        turn = state.turn
+        key = state.hash
+        point = None
+        flipped = []
 
         if move != "pass":
             point = self.to_grid(move)
-            player = state["player"]
-
-            board[point] = state["player"]
-            for dir in self.directions:
-                end = raycast(state, point, dir)
-                if end:
-                    mark_line(board, player, point, dir, end)
-
-        return {
-            "turn": state["turn"] + 1,
-            "player": opponent(state["player"]),
-            "board": board
-        }
+            board = state.board
+            code = CODE[player]
+            flipped = self.flips(board, code, point)
+
+            own = self.zobrist[player]
+            enemy = self.zobrist[opponent(player)]
+            board[point] = code
+            state.hash ^= own[point]
+            for loc in flipped:
+                board[loc] = code
+                state.hash ^= own[loc] ^ enemy[loc]
+            state.count(player == BLACK, len(flipped), 1)
+
+        state.hash ^= self.zobrist_side
+        state.turn = turn + 1
+        state.player = opponent(player)
+        return point, flipped, player, turn, key
+
+    def undo(self, state, record):
+        """ Reverts an apply() given its undo record.
+        """
+        point, flipped, player, turn, key = record
+
+        if point is not None:
+            board = state.board
+            enemy = 3 - CODE[player]
+            board[point] = CODE[EMPTY]
+            for loc in flipped:
+                board[loc] = enemy
+            state.count(player == BLACK, len(flipped), -1)
+
+        state.turn = turn
+        state.player = player
+        state.hash = key
+
+    def changes(self, record):
+        """ (square, flipped squares) of an undo record, squares numbered
+            x-major from 0 like the bitboard bits, square None for a pass.
+        """
+        point, flipped = record[:2]
+        if point is None:
+            return None, ()
+        square_of = self.square_of
+        return square_of[point], [square_of[loc] for loc in flipped]
 
     def over(self, state):
         """ Check if it's game over for current player.
         """
         return not self.legal_moves(state)
 
+    def empty_count(self, state):
+        return self.w * self.h - state.black_count - state.white_count
+
     def top_scoring_player(self, state):
         black = self.score_player(state, BLACK)
         white = self.score_player(state, WHITE)
@@ -157,7 +317,7 @@ class Reversi:
         def print_row(y):
             begin = y * (self.w_) + 1
             end = begin + self.w
-            print('{} {}'.format(str(y), ' '.join(board[begin:end])))
+            print('{} {}'.format(str(y), ' '.join(MARKERS[code] for code in board[begin:end])))
 
         print("  {}".format(' '.join(ascii_lowercase[0:self.w])))
 
@@ -170,6 +330,5 @@ class Reversi:
     def score_player(self, state, player):
         """ Score(Player) = Count(Markers for Player)
         """
-        coins = [x for x in state["board"] if x == player]
-        return len(coins)
+        return state.black_count if player == BLACK else state.white_count
 
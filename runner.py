@@ -1,75 +1,120 @@
 import argparse
-import time
 import cProfile
 
-from reversi import Reversi, move_repr, BLACK, WHITE
-from agents import *
-
-parser = argparse.ArgumentParser(description="Play some Reversi.")
-parser.add_argument("--verbose", help="output some helpful info", action="store_true")
-parser.add_argument("--timeout", help="set the ai max turn time in seconds", action="store", type=int, dest="timeout", default=60)
-parser.add_argument("--blind", help="silence board printing", action="store_true")
-parser.add_argument("--profile", help="you know what is up", action="store_true")
-parser.add_argument("--depth", help="set the ai max turn time in seconds", action="store", type=int, dest="depth", default=4)
-parser.add_argument("--moves", help="print moves in YX format starting with player1", action="store_true")
-parser.add_argument("--player1", choices=['rng', 'minmax', 'alphabeta', 'self'], help="specify player 1's agent")
-parser.add_argument("--player2", choices=['rng', 'minmax', 'alphabeta', 'self'], help="specify player 2's agent")
-# add --interactive option to step through each turn
-args = parser.parse_args()
-
-def play_game(game, agents):
-    moves = []
-    state = game.initial_state()
+import match
+from match import build_agent, play_match
+
+
+class Profiled:
+    """ Prints a cProfile table for every move of agent.
+    """
+
+    def __init__(self, agent):
+        self.agent = agent
+
+    def next_move(self, game, state, timeout):
+        pr = cProfile.Profile()
+        pr.enable()
+        try:
+            return self.agent.next_move(game, state, timeout)
+        finally:
+            pr.disable()
+            pr.print_stats(sort='time')
+
+    def __getattr__(self, name):
+        if name == "agent":
+            raise AttributeError(name)
+        return getattr(self.agent, name)
+
+
+def agent_options(args):
+    return {"depth": args.depth, "iterative": args.iterative, "game_time": args.game_time,
+            "tt_size": args.tt_size, "workers": args.workers, "endgame": args.endgame,
+            "book": args.book, "weights": args.weights, "rollouts": args.rollouts,
+            "timing": args.timing, "ponder": args.ponder, "cache_size": args.cache_size,
+            "database": args.database}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play some Reversi.")
+    parser.add_argument("--verbose", help="output some helpful info", action="store_true")
+    parser.add_argument("--timeout", help="set the ai max turn time in seconds", action="store", type=int, dest="timeout", default=60)
+    parser.add_argument("--blind", help="silence board printing", action="store_true")
+    parser.add_argument("--profile", help="you know what is up", action="store_true")
+    parser.add_argument("--depth", help="set the ai max turn time in seconds", action="store", type=int, dest="depth", default=4)
+    parser.add_argument("--iterative", help="search deeper until the turn budget is spent, ignores --depth", action="store_true")
+    parser.add_argument("--game-time", help="set the ai total time for the game in seconds", action="store", type=float, dest="game_time", default=None)
+    parser.add_argument("--tt-size", help="set the alphabeta transposition table size in MB", action="store", type=int, dest="tt_size", default=16)
+    parser.add_argument("--cache-size", help="positions whose moves and scores minmax/alphabeta remember", action="store", type=int, dest="cache_size", default=100000)
+    parser.add_argument("--share-cache", help="both players use one position cache", action="store_true")
+    parser.add_argument("--rollouts", help="mcts random playouts per tree iteration", action="store", type=int, dest="rollouts", default=8)
+    parser.add_argument("--workers", help="split the alphabeta root search over N processes, or run N mcts trees", action="store", type=int, dest="workers", default=1)
+    parser.add_argument("--endgame", help="alphabeta solves the game exactly with N or fewer empty squares", action="store", type=int, dest="endgame", default=12)
+    parser.add_argument("--book", help="alphabeta plays from this opening book file (see book.py)", action="store", dest="book", default=None)
+    parser.add_argument("--database", help="mcts starts new nodes from this position database's outcomes (see database.py)", action="store", dest="database", default=None)
+    parser.add_argument("--weights", help="alphabeta pattern weights file, built-in weights by default", action="store", dest="weights", default=None)
+    parser.add_argument("--ponder", help="alphabeta keeps searching the expected reply on the opponent's time", action="store_true")
+    parser.add_argument("--timing", help="split search time into move generation, make/undo and evaluation", action="store_true")
+    parser.add_argument("--stats", help="append a JSON line of search stats per move to this file", action="store", dest="stats", default=None)
+    parser.add_argument("--moves", help="print moves in YX format starting with player1", action="store_true")
+    parser.add_argument("--bitboard", help="use the 64-bit bitboard engine", action="store_true")
+    parser.add_argument("--player1", choices=match.AGENT_NAMES, help="specify player 1's agent")
+    parser.add_argument("--player2", choices=match.AGENT_NAMES, help="specify player 2's agent")
+    parser.add_argument("--tournament", help="play N silent games round-robin over a process pool", action="store", type=int, dest="tournament", default=0)
+    parser.add_argument("--agents", help="comma separated agents for --tournament", action="store", dest="agents", default=None)
+    parser.add_argument("--pool", help="tournament processes, defaults to one per core", action="store", type=int, dest="pool", default=None)
+    parser.add_argument("--results", help="append tournament results as JSON lines to this file", action="store", dest="results", default="tournament.jsonl")
+    parser.add_argument("--record", help="append the moves of every game to this file, binary if it ends in .bin", action="store", dest="record", default=None)
+    parser.add_argument("--seed", help="tournament random seed", action="store", type=int, dest="seed", default=0)
+    # add --interactive option to step through each turn
+    args = parser.parse_args(argv)
+
+    if args.tournament:
+        import tournament
+        names = args.agents.split(',') if args.agents else tournament.AGENT_NAMES
+        options = {"depth": args.depth, "tt_size": args.tt_size, "iterative": args.iterative,
+                   "endgame": args.endgame, "book": args.book, "weights": args.weights, "rollouts": args.rollouts, "timeout": args.timeout, "bitboard": args.bitboard,
+                   "seed": args.seed, "cache_size": args.cache_size, "database": args.database}
+        results = tournament.run_tournament(names, args.tournament, options, args.results, args.pool, args.record)
+        tournament.print_summary(names, results)
+        return
+
+    if args.bitboard:
+        from bitboard import BitReversi
+        game = BitReversi()
+    else:
+        from reversi import Reversi
+        game = Reversi()
+    options = agent_options(args)
+    if args.share_cache:
+        options["cache"] = match.position_cache(options)
+    agents = [build_agent(name, options) for name in (args.player1, args.player2)]
+    if args.profile:
+        agents = [Profiled(agent) for agent in agents]
+
+    observers = []
     if not args.blind:
-       game.print_board(state)
-    while True:
-        passes = 0
+        observers.append(match.BoardPrinter())
+    if args.verbose:
+        observers.append(match.StatsPrinter())
+    if args.moves:
+        observers.append(match.MovePrinter())
+    if args.stats:
+        observers.append(match.StatsWriter(args.stats))
+    if args.record:
+        observers.append(match.Archive(args.record))
+
+    try:
+        state, moves, records = play_match(game, agents, args.timeout, observers)
+    finally:
         for agent in agents:
-            # Press key to continue...
-            time1 = time.time()
-            if args.profile:
-                pr = cProfile.Profile()
-                pr.enable()
-                move = agent.next_move(game, state, args.timeout)
-                pr.disable()
-                pr.print_stats(sort='time')
-            else:
-                move = agent.next_move(game, state, args.timeout)
-
-            time2 = time.time()
-            new_state = game.make_move(state, move)
-            if args.verbose:
-                print("Turn {} for player {} took {:0.3f} ms, {} score".format(state["turn"], state["player"], (time2-time1)*1000.0, game.score_player(new_state, state["player"])))
-            state = new_state
-            if not args.blind:
-                game.print_board(state)
-            if args.moves:
-                print(move_repr(move))
-            moves.append(move)
-            if move == "pass":
-                passes += 1
-        if passes == len(agents):
-            return state, moves
-
-def str_to_agent(name):
-    if name == "rng" or not name:
-        return RandomAgent()
-    elif name == "minmax":
-        return MinMaxAgent(args.depth)
-    elif name == "alphabeta":
-        return AlphaBetaAgent(args.depth)
-    elif name == "self":
-        return InteractiveAgent()
-
-
-game = Reversi()
-agents = list(map(str_to_agent, [args.player1, args.player2]))
-
-state, moves = play_game(game, agents)
-winner, score = game.top_scoring_player(state)
-
-#for move in moves:
-#   print move_repr(move)
-
-game.print_board(state)
-print("Winner is {} at turn {} with {} score!".format(winner, state["turn"], score))
+            if hasattr(agent, "close"):
+                agent.close()
+    winner, score = game.top_scoring_player(state)
+
+    game.print_board(state)
+    print("Winner is {} at turn {} with {} score!".format(winner, state["turn"], score))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import time
+
+
+class SearchTimeout(Exception):
+    """ Raised inside a search when the hard deadline has passed.
+    """
+    pass
+
+
+class TimeManager:
+    """ Budgets each turn of a game.
+
+        timeout is the hard per-move limit given to next_move. With a
+        game_time (seconds for all of one player's moves) the budget
+        is the remaining clock spread over the moves still to play,
+        estimated as half of the empty squares.
+
+        soft: don't start another iteration after this
+        hard: abort the search in progress
+    """
+    SOFT_RATIO = 0.5
+    HARD_RATIO = 0.95
+
+    def __init__(self, game_time=None):
+        self.remaining = game_time
+        self.started = self.soft = self.hard = None
+
+    def budget(self, game, state, timeout):
+        if self.remaining is None:
+            return timeout
+        moves_left = max(1, game.empty_count(state) // 2)
+        return max(0.0, min(timeout, self.remaining / moves_left))
+
+    def start(self, game, state, timeout):
+        self.started = time.time()
+        budget = self.budget(game, state, timeout)
+        self.soft = self.started + budget * self.SOFT_RATIO
+        self.hard = self.started + budget * self.HARD_RATIO
+        return self.hard
+
+    def soft_expired(self):
+        return time.time() >= self.soft
+
+    def stop(self):
+        """ Charge the finished turn to the game clock.
+        """
+        if self.remaining is not None and self.started is not None:
+            self.remaining -= time.time() - self.started
+        self.started = None
+
+
+# Phase timing. Agents with timing on wrap the game and evaluator in
+# Timed proxies for the turn, so there is no cost when it is off.
+GAME_PHASES = {"legal_moves": "movegen", "apply": "make_move",
+               "undo": "make_move", "make_move": "make_move",
+               "score_player": "evaluate"}
+EVALUATOR_PHASES = {"update": "evaluate", "score": "evaluate", "reset": "evaluate"}
+
+
+class Timed:
+    """ Stands in for obj, adding the seconds spent in the methods
+        named in phases to totals[phase].
+    """
+
+    def __init__(self, obj, phases, totals):
+        self.wrapped = obj
+        for name, phase in phases.items():
+            totals.setdefault(phase, 0.0)
+            setattr(self, name, self.timer(getattr(obj, name), phase, totals))
+
+    @staticmethod
+    def timer(method, phase, totals):
+        def timed(*args):
+            time1 = time.time()
+            try:
+                return method(*args)
+            finally:
+                totals[phase] += time.time() - time1
+        return timed
+
+    def __getattr__(self, name):
+        if name == "wrapped":
+            raise AttributeError(name)
+        return getattr(self.wrapped, name)
+
+
+def untimed(obj):
+    return obj.wrapped if isinstance(obj, Timed) else obj
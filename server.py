@@ -0,0 +1,385 @@
+""" Match server: many games at once, players connected over sockets.
+
+    python server.py --port 8765 --move-time 10 --workers 4
+
+    Needs Python 3. Every connection plays one game against a built-in
+    agent, or against the next connection that asks for a remote
+    opponent. Built-in agents search in worker processes, each game's
+    agent always on the same one so it keeps its tables between moves,
+    and the server itself only waits on sockets, so it can host
+    hundreds of games. Protocol, one line per message, moves as
+    move_repr prints them ("5d", "PASS"):
+
+    client: PLAY <opponent> [<w>x<h>]
+            opponent is rng, minmax, alphabeta, mcts or remote
+    server: GAME <number> <black|white> <w>x<h> <seconds per move>
+    server: MOVED <move>            the opponent played move
+    server: TURN <seconds>          your move, within seconds
+    client: <move>                  PASS only without a legal move
+    server: ILLEGAL <text>          try again, the clock keeps running
+    server: END <win|loss|draw> <your discs> <opponent's discs> <reason>
+            reason is over, timeout, disconnect, illegal (a built-in
+            agent's move) or error (the server failed, no one loses); a
+            player who times out or disconnects loses
+    server: ERROR <text>            bad request, a board too big for a
+                                    binary --record file, every worker
+                                    busy, no remote opponent within
+                                    --pair-time or a message sent while
+                                    waiting for one, the connection is
+                                    closed
+
+    A line longer than the stream limit (64 KB) counts as a disconnect,
+    and only printable ASCII of a line is read or echoed back.
+
+    A built-in agent's clock starts when its worker takes the move up,
+    not while the move waits behind other games' moves, and each worker
+    serves at most --games-per-worker games.
+"""
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from reversi import Reversi, BLACK, WHITE, move_repr, parse_move
+from bitboard import BitReversi
+from match import AGENT_NAMES, build_agent
+from records import RecordWriter, PASS
+
+BUILTIN = [name for name in AGENT_NAMES if name != "self"]
+# on top of the move time, for messages in flight
+GRACE = 0.5
+# to send PLAY after connecting
+REQUEST_TIME = 30
+# to wait for a remote opponent
+PAIR_TIME = 300
+MIN_SIZE, MAX_SIZE = 4, 16
+GAMES_PER_WORKER = 8
+
+
+def make_game(w, h):
+    if (w, h) == (8, 8):
+        return BitReversi()
+    return Reversi(h, w)
+
+
+def is_legal(game, state, move):
+    moves = game.legal_moves(state)
+    return move in moves if move != "pass" else not moves
+
+
+# The built-in agents of the games a worker process is serving.
+_agents = {}
+
+def builtin_move(key, name, options, game, state, seconds):
+    """ (move, seconds spent), timed from when the worker starts on it.
+    """
+    start = time.time()
+    agent = _agents.get(key)
+    if agent is None:
+        agent = _agents[key] = build_agent(name, options)
+    move = agent.next_move(game, state, seconds)
+    return move, time.time() - start
+
+
+def forget_agent(key):
+    agent = _agents.pop(key, None)
+    if agent is not None and hasattr(agent, "close"):
+        agent.close()
+
+
+class Disconnected(Exception):
+    pass
+
+
+class RemotePlayer:
+    """ A client on the other end of a connection.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.name = "remote"
+
+    async def send(self, *words):
+        try:
+            self.writer.write((" ".join(str(word) for word in words) + "\n").encode("ascii", "replace"))
+            await self.writer.drain()
+        except (ConnectionError, OSError):
+            raise Disconnected()
+
+    async def receive(self, timeout):
+        """ The next line, printable ASCII only. A line over the stream
+            limit is treated like a hang-up.
+        """
+        try:
+            line = await asyncio.wait_for(self.reader.readline(), timeout)
+        except (ValueError, asyncio.LimitOverrunError, ConnectionError):
+            raise Disconnected()
+        if not line:
+            raise Disconnected()
+        text = line.decode("ascii", "ignore")
+        return "".join(char for char in text if " " <= char <= "~").strip()
+
+    async def start(self, number, colour, game, seconds):
+        await self.send("GAME", number, "black" if colour == BLACK else "white",
+                        "{}x{}".format(game.w, game.h), seconds)
+
+    async def next_move(self, game, state, seconds):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + seconds + GRACE
+        await self.send("TURN", seconds)
+        while True:
+            text = await self.receive(max(0, deadline - loop.time()))
+            try:
+                move = parse_move(text)
+            except (ValueError, IndexError):
+                move = None
+            if move is not None and is_legal(game, state, move):
+                return move
+            await self.send("ILLEGAL", text or "-")
+
+    async def moved(self, move):
+        await self.send("MOVED", move_repr(move))
+
+    async def finished(self, outcome, own, other, reason):
+        await self.send("END", outcome, own, other, reason)
+
+    def close(self):
+        self.writer.close()
+
+
+class BuiltinPlayer:
+    """ One of the agents from match.build_agent, moving in executor,
+        a single process pool. Only the time the agent itself takes
+        counts against the move clock, so a move waiting for the worker
+        is never forfeited.
+    """
+
+    def __init__(self, name, options, executor, key):
+        self.name = name
+        self.options = options
+        self.executor = executor
+        self.key = key
+
+    async def start(self, number, colour, game, seconds):
+        pass
+
+    async def next_move(self, game, state, seconds):
+        loop = asyncio.get_running_loop()
+        move, spent = await loop.run_in_executor(self.executor, builtin_move, self.key, self.name,
+                                                 self.options, game, state, seconds)
+        if spent > seconds + GRACE:
+            raise asyncio.TimeoutError()
+        return move
+
+    async def moved(self, move):
+        pass
+
+    async def finished(self, outcome, own, other, reason):
+        await asyncio.get_running_loop().run_in_executor(self.executor, forget_agent, self.key)
+
+
+class MatchServer:
+    """ executors are single process pools, each game against a
+        built-in agent goes to the least loaded one that has fewer than
+        games_per_worker games.
+    """
+
+    def __init__(self, options, seconds, executors, records_path=None,
+                 games_per_worker=GAMES_PER_WORKER, pair_time=PAIR_TIME):
+        self.options = options
+        self.seconds = seconds
+        self.executors = executors
+        self.games_per_worker = games_per_worker
+        self.pair_time = pair_time
+        self.load = [0] * len(executors)
+        self.records = RecordWriter(records_path) if records_path else None
+        self.numbers = itertools.count(1)
+        # per board size a remote player waiting for an opponent, the
+        # future their handler waits on and the read watching for them
+        # to hang up, which the opponent cancels when the game starts
+        self.waiting = {}
+        self.active = 0
+
+    async def handle(self, reader, writer):
+        player = RemotePlayer(reader, writer)
+        try:
+            try:
+                words = (await player.receive(REQUEST_TIME)).split()
+            except (asyncio.TimeoutError, Disconnected):
+                return
+            if not words or words[0].upper() != "PLAY" or len(words) > 3:
+                await player.send("ERROR", "expected PLAY <opponent> [<w>x<h>]")
+                return
+            opponent = words[1].lower() if len(words) > 1 else "remote"
+            try:
+                w, h = map(int, words[2].lower().split("x")) if len(words) > 2 else (8, 8)
+            except ValueError:
+                w = h = 0
+            if not (MIN_SIZE <= w <= MAX_SIZE and MIN_SIZE <= h <= MAX_SIZE and w % 2 == h % 2 == 0):
+                await player.send("ERROR", "board sizes are even, {} to {}".format(MIN_SIZE, MAX_SIZE))
+                return
+            if self.records and self.records.binary and w * h >= PASS:
+                await player.send("ERROR", "binary records hold boards of at most {} squares".format(PASS - 1))
+                return
+            if opponent == "remote":
+                await self.pair(player, w, h)
+            elif opponent in BUILTIN:
+                index = min(range(len(self.executors)), key=self.load.__getitem__)
+                if self.load[index] >= self.games_per_worker:
+                    await player.send("ERROR", "all workers busy, try again later")
+                    return
+                number = next(self.numbers)
+                builtin = BuiltinPlayer(opponent, self.options, self.executors[index], number)
+                self.load[index] += 1
+                try:
+                    await self.play(number, make_game(w, h), [player, builtin])
+                finally:
+                    self.load[index] -= 1
+            else:
+                await player.send("ERROR", "unknown opponent {}".format(opponent))
+        except Disconnected:
+            pass
+        finally:
+            player.close()
+
+    async def pair(self, player, w, h):
+        """ Waits for the next remote player asking for the same board,
+            the first one to arrive plays black. A waiting player who
+            hangs up, says anything or waits longer than pair_time is
+            dropped.
+        """
+        entry = self.waiting.get((w, h))
+        if entry is not None and not entry[2].done():
+            first, done, watch = self.waiting.pop((w, h))
+            watch.cancel()
+            try:
+                await self.play(next(self.numbers), make_game(w, h), [first, player])
+            finally:
+                done.set_result(None)
+            return
+
+        done = asyncio.get_running_loop().create_future()
+        watch = asyncio.ensure_future(player.reader.read(1))
+        self.waiting[w, h] = (player, done, watch)
+        try:
+            await asyncio.wait([watch], timeout=self.pair_time)
+            if watch.cancelled():
+                # paired, the game is on
+                await done
+                return
+        finally:
+            watch.cancel()
+            if self.waiting.get((w, h), (None,))[0] is player:
+                del self.waiting[w, h]
+        if not watch.done():
+            await player.send("ERROR", "no opponent within {} seconds".format(self.pair_time))
+        elif watch.exception() is None and watch.result():
+            await player.send("ERROR", "nothing expected before GAME")
+
+    async def play(self, number, game, players):
+        """ players[0] is black. Like match.play_match, but a player
+            who runs out of time or disconnects loses on the spot.
+        """
+        self.active += 1
+        state = game.initial_state()
+        moves = []
+        loser = reason = None
+        try:
+            for player, colour in zip(players, (BLACK, WHITE)):
+                try:
+                    await player.start(number, colour, game, self.seconds)
+                except Disconnected:
+                    loser, reason = colour, "disconnect"
+            passes = 0
+            try:
+                while loser is None and passes < len(players):
+                    index = 0 if state.player == BLACK else 1
+                    try:
+                        move = await players[index].next_move(game, state, self.seconds)
+                    except asyncio.TimeoutError:
+                        loser, reason = state.player, "timeout"
+                        break
+                    except Disconnected:
+                        loser, reason = state.player, "disconnect"
+                        break
+                    if not is_legal(game, state, move):
+                        loser, reason = state.player, "illegal"
+                        break
+                    state = game.make_move(state, move)
+                    moves.append(move)
+                    passes = passes + 1 if move == "pass" else 0
+                    try:
+                        await players[1 - index].moved(move)
+                    except Disconnected:
+                        loser, reason = state.player, "disconnect"
+            except Exception:
+                # still tell both players and let the built-in agent go
+                await self.finish(number, game, state, players, None, "error")
+                raise
+            await self.finish(number, game, state, players, loser, reason or "over")
+            if self.records and reason is None:
+                try:
+                    self.records.write(game, moves)
+                except (ValueError, OSError) as error:
+                    print("game {} not recorded: {}".format(number, error))
+        finally:
+            self.active -= 1
+
+    async def finish(self, number, game, state, players, loser, reason):
+        discs = {BLACK: game.score_player(state, BLACK), WHITE: game.score_player(state, WHITE)}
+        if reason == "over" and discs[BLACK] != discs[WHITE]:
+            loser = BLACK if discs[BLACK] < discs[WHITE] else WHITE
+        for player, colour in zip(players, (BLACK, WHITE)):
+            other = WHITE if colour == BLACK else BLACK
+            outcome = "draw" if loser is None else "loss" if loser == colour else "win"
+            try:
+                await player.finished(outcome, discs[colour], discs[other], reason)
+            except Disconnected:
+                pass
+        print("game {}: {} {} - {} {}, {} ({} games in progress)".format(
+            number, players[0].name, discs[BLACK], discs[WHITE], players[1].name,
+            "draw" if loser is None else ("white" if loser == BLACK else "black") + " wins " + reason,
+            self.active - 1))
+
+
+async def serve(server, host, port):
+    listener = await asyncio.start_server(server.handle, host, port)
+    print("serving on {}:{}".format(host, port))
+    async with listener:
+        await listener.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host Reversi games over sockets.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--move-time", help="seconds per move", type=float, dest="move_time", default=10)
+    parser.add_argument("--workers", help="processes for the built-in agents, one per core by default", type=int, default=None)
+    parser.add_argument("--pair-time", help="seconds to wait for a remote opponent", type=float, dest="pair_time", default=PAIR_TIME)
+    parser.add_argument("--games-per-worker", help="most games against built-in agents per worker", type=int, dest="games_per_worker", default=GAMES_PER_WORKER)
+    parser.add_argument("--depth", help="built-in agents' search depth", type=int, default=4)
+    parser.add_argument("--iterative", help="built-in agents search until the move time is spent", action="store_true")
+    parser.add_argument("--endgame", help="alphabeta solves the game exactly with N or fewer empty squares", type=int, default=12)
+    parser.add_argument("--weights", help="alphabeta pattern weights file", default=None)
+    parser.add_argument("--record", help="append the moves of every finished game to this file", default=None)
+    args = parser.parse_args()
+
+    options = {"depth": args.depth, "iterative": args.iterative, "endgame": args.endgame,
+               "weights": args.weights}
+    executors = [ProcessPoolExecutor(1) for _ in range(args.workers or multiprocessing.cpu_count())]
+    server = MatchServer(options, args.move_time, executors, args.record, args.games_per_worker,
+                         args.pair_time)
+    try:
+        asyncio.run(serve(server, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for executor in executors:
+            executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+""" Stable discs.
+
+    A disc is stable when no sequence of moves can flip it. Along each
+    of the four axes (column, row and the two diagonals) a disc is safe
+    if its line is full, or if a neighbour on that axis is the wall or a
+    stable disc of its colour. A disc that is safe along all four axes
+    is stable. Starting from no stable discs, the rule is applied to all
+    discs at once with shifts of the board masks until nothing changes.
+    That finds the corners, the discs anchored to them and discs on full
+    lines. It is a lower bound: a few stable discs the rule can't prove
+    are missed.
+
+    Masks number squares x-major from 0, like patterns.square_index and
+    the bitboard, so BitReversi states can be used as they are.
+"""
+from reversi import BLACK, WHITE, CODE
+
+from bitboard import popcount
+
+
+def board_masks(game, state):
+    """ (black, white) masks of state, from either engine.
+    """
+    if "black" in state:
+        return state.black, state.white
+    black = white = 0
+    h = game.h
+    black_code, white_code = CODE[BLACK], CODE[WHITE]
+    for (x, y), point in game.squares:
+        code = state.board[point]
+        if code != black_code and code != white_code:
+            continue
+        bit = 1 << ((x - 1) * h + (y - 1))
+        if code == black_code:
+            black |= bit
+        else:
+            white |= bit
+    return black, white
+
+
+class StabilityAnalyzer:
+    """ Stable discs on a w x h board.
+    """
+
+    def __init__(self, w, h):
+        self.w = w
+        self.h = h
+        self.squares = w * h
+        bit = lambda x, y: 1 << ((x - 1) * h + (y - 1))
+        cells = [(x, y) for x in range(1, w + 1) for y in range(1, h + 1)]
+        self.board = (1 << self.squares) - 1
+        self.corners = bit(1, 1) | bit(1, h) | bit(w, 1) | bit(w, h)
+        # shifting by one square along y must not wrap into the next column
+        self.not_top = sum(bit(x, y) for x, y in cells if y != 1)
+        self.not_bottom = sum(bit(x, y) for x, y in cells if y != h)
+
+        # lines per axis: rows (along x), columns (along y), diagonals
+        # (x and y growing together) and anti-diagonals
+        rows = [sum(bit(x, y) for x in range(1, w + 1)) for y in range(1, h + 1)]
+        columns = [sum(bit(x, y) for y in range(1, h + 1)) for x in range(1, w + 1)]
+        diagonals = {}
+        anti = {}
+        for x, y in cells:
+            diagonals[x - y] = diagonals.get(x - y, 0) | bit(x, y)
+            anti[x + y] = anti.get(x + y, 0) | bit(x, y)
+        self.lines = [rows, columns, list(diagonals.values()), list(anti.values())]
+        # (axis, mask) of every line and per square the lines through
+        # it, for keeping full lines up to date a move at a time
+        self.line_masks = [(axis, line) for axis, lines in enumerate(self.lines) for line in lines]
+        self.through = [[i for i, (_, line) in enumerate(self.line_masks) if line >> square & 1]
+                        for square in range(self.squares)]
+
+        # squares with the wall next to them along each axis
+        edge = sum(bit(x, y) for x, y in cells if x in (1, w) or y in (1, h))
+        self.walls = [sum(bit(x, y) for x, y in cells if x in (1, w)),
+                      sum(bit(x, y) for x, y in cells if y in (1, h)),
+                      edge, edge]
+
+    def full_lines(self, occupied):
+        """ Per axis the squares whose line along it is full.
+        """
+        full = []
+        for lines in self.lines:
+            mask = 0
+            for line in lines:
+                if occupied & line == line:
+                    mask |= line
+            full.append(mask)
+        return full
+
+    def stable(self, own, full, seed=0):
+        """ Stable discs among own, full as from full_lines. seed is
+            discs already known to be stable, e.g. the stable discs of
+            an earlier position of the same game, and saves iterations.
+        """
+        h = self.h
+        not_top = self.not_top
+        not_bottom = self.not_bottom
+        rows = full[0] | self.walls[0]
+        columns = full[1] | self.walls[1]
+        diagonals = full[2] | self.walls[2]
+        anti = full[3] | self.walls[3]
+
+        stable = seed & own
+        while True:
+            found = stable | (own
+                              & (rows | stable << h | stable >> h)
+                              & (columns | (stable << 1) & not_top | (stable >> 1) & not_bottom)
+                              & (diagonals | (stable << h + 1) & not_top | (stable >> h + 1) & not_bottom)
+                              & (anti | (stable << h - 1) & not_bottom | (stable >> h - 1) & not_top))
+            if found == stable:
+                return stable
+            stable = found
+
+    def discs(self, black, white, seeds=(0, 0), full=None):
+        """ (stable black discs, stable white discs) as masks, seeds as
+            for stable, full as from full_lines if already known.
+            Without a corner of its own a colour could only have stable
+            discs on full lines, which is rare enough before the endgame
+            that it is not looked for.
+        """
+        corners = self.corners
+        if not (black | white) & corners:
+            return seeds[0] & black, seeds[1] & white
+        if full is None:
+            full = self.full_lines(black | white)
+        stable_black = self.stable(black, full, seeds[0]) if black & corners else seeds[0] & black
+        stable_white = self.stable(white, full, seeds[1]) if white & corners else seeds[1] & white
+        return stable_black, stable_white
+
+    def count(self, black, white, seeds=(0, 0)):
+        """ (stable black discs, stable white discs).
+        """
+        stable_black, stable_white = self.discs(black, white, seeds)
+        return popcount(stable_black), popcount(stable_white)
+
+    def upper_bound(self, own, opp):
+        """ Best final disc differential own can still reach: every
+            square except the opponent's stable discs, which are never
+            lost.
+        """
+        return self.squares - 2 * self.count(opp, own)[0]
@@ -0,0 +1,151 @@
+import json
+import math
+import multiprocessing
+import random
+from itertools import permutations
+
+from reversi import Reversi, BLACK, WHITE, move_repr, parse_move
+from bitboard import BitReversi
+from match import AGENT_NAMES as MATCH_AGENTS, build_agent, play_match
+from records import RecordWriter
+
+# every agent that plays without a human
+AGENT_NAMES = [name for name in MATCH_AGENTS if name != "self"]
+
+
+def schedule(names, games):
+    """ games pairings, cycling through every ordered pair of names
+        so each pairing is played with colours swapped.
+    """
+    pairs = list(permutations(names, 2))
+    return [(i, pairs[i % len(pairs)]) for i in range(games)]
+
+
+def play_scheduled(task):
+    index, (black, white), options = task
+    random.seed(options["seed"] + index)
+    game = BitReversi() if options["bitboard"] else Reversi()
+    agents = [build_agent(black, options), build_agent(white, options)]
+    state, moves, records = play_match(game, agents, options["timeout"])
+    times = [record["time"] for record in records]
+
+    score = {"black": game.score_player(state, BLACK),
+             "white": game.score_player(state, WHITE)}
+    if score["black"] == score["white"]:
+        winner = None
+    else:
+        winner = black if score["black"] > score["white"] else white
+    return {
+        "game": index,
+        "black": black,
+        "white": white,
+        "winner": winner,
+        "score": score,
+        "turns": state["turn"],
+        "moves": [move_repr(move) for move in moves],
+        "move_times": {"black": times[0::2], "white": times[1::2]}
+    }
+
+
+def run_tournament(names, games, options, results_path, processes=None, records_path=None):
+    """ Plays the schedule over a process pool and appends each result
+        to results_path as a JSON line as soon as the game ends, and
+        the moves to records_path (see records.py) if given.
+    """
+    tasks = [(index, pair, options) for index, pair in schedule(names, games)]
+    results = []
+    game = BitReversi() if options["bitboard"] else Reversi()
+    records = RecordWriter(records_path) if records_path else None
+    pool = multiprocessing.Pool(processes)
+    try:
+        with open(results_path, "a") as out:
+            for result in pool.imap_unordered(play_scheduled, tasks):
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+                if records:
+                    records.write(game, [parse_move(move) for move in result["moves"]])
+                results.append(result)
+    finally:
+        pool.close()
+        pool.join()
+        if records:
+            records.close()
+    return results
+
+
+def standings(names, results):
+    """ {name: (games, wins, draws, losses)}
+    """
+    table = dict((name, [0, 0, 0, 0]) for name in names)
+    for result in results:
+        for name in (result["black"], result["white"]):
+            row = table[name]
+            row[0] += 1
+            if result["winner"] is None:
+                row[2] += 1
+            elif result["winner"] == name:
+                row[1] += 1
+            else:
+                row[3] += 1
+    return dict((name, tuple(row)) for name, row in table.items())
+
+
+def elo_ratings(names, results, iterations=200):
+    """ Maximum likelihood (Bradley-Terry) ratings on the Elo scale,
+        mean 0. Each pair gets one virtual draw so an agent that never
+        wins still has a finite rating.
+    """
+    points = dict(((a, b), 0.0) for a in names for b in names if a != b)
+    played = dict(points)
+    for a, b in points:
+        points[a, b] += 0.5
+        played[a, b] += 1
+    for result in results:
+        a, b = result["black"], result["white"]
+        played[a, b] += 1
+        played[b, a] += 1
+        if result["winner"] is None:
+            points[a, b] += 0.5
+            points[b, a] += 0.5
+        elif result["winner"] == a:
+            points[a, b] += 1
+        else:
+            points[b, a] += 1
+
+    strength = dict((name, 1.0) for name in names)
+    for _ in range(iterations):
+        for a in names:
+            wins = sum(points[a, b] for b in names if b != a)
+            expected = sum(played[a, b] / (strength[a] + strength[b])
+                           for b in names if b != a)
+            strength[a] = wins / expected
+    ratings = dict((name, 400 * math.log10(strength[name])) for name in names)
+    mean = sum(ratings.values()) / len(ratings)
+    return dict((name, rating - mean) for name, rating in ratings.items())
+
+
+def print_summary(names, results):
+    table = standings(names, results)
+    ratings = elo_ratings(names, results)
+    print("{:<10} {:>6} {:>6} {:>6} {:>6} {:>8} {:>8}".format(
+        "agent", "games", "wins", "draws", "losses", "win%", "elo"))
+    for name in sorted(names, key=ratings.get, reverse=True):
+        games, wins, draws, losses = table[name]
+        rate = 100.0 * (wins + 0.5 * draws) / games if games else 0.0
+        print("{:<10} {:>6} {:>6} {:>6} {:>6} {:>7.1f}% {:>+8.0f}".format(
+            name, games, wins, draws, losses, rate, ratings[name]))
+
+    # row agent's score against column agent
+    print("")
+    print("{:<10} ".format("vs") + " ".join("{:>10}".format(name) for name in names))
+    for a in names:
+        cells = []
+        for b in names:
+            games = [r for r in results if set((r["black"], r["white"])) == set((a, b)) and a != b]
+            if not games:
+                cells.append("{:>10}".format("-"))
+                continue
+            score = sum(1.0 if r["winner"] == a else 0.5 if r["winner"] is None else 0.0
+                        for r in games)
+            cells.append("{:>9.1f}%".format(100.0 * score / len(games)))
+        print("{:<10} ".format(a) + " ".join(cells))
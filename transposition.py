@@ -0,0 +1,61 @@
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# Rough size of one stored entry: the slot in the list plus the
+# (key, depth, flag, score, move, generation) tuple and its ints.
+ENTRY_BYTES = 160
+
+
+class TranspositionTable:
+    """ Fixed-size table of search results indexed by the low bits of
+        a position's Zobrist key. Entries are (key, depth, flag, score,
+        move, generation) tuples. Scores are negamax values for the side
+        to move in the stored position (the key includes it), and flag
+        says whether the score is exact or a lower or upper bound for
+        that side, so both colours' searches can read an entry. Scores
+        are only comparable under one evaluation, so agents with
+        different weights still need their own tables.
+    """
+
+    def __init__(self, megabytes=16):
+        slots = 1
+        while slots * 2 * ENTRY_BYTES <= megabytes * 1024 * 1024:
+            slots *= 2
+        self.mask = slots - 1
+        self.slots = [None] * slots
+        self.generation = 0
+        self.hits = 0
+        self.probes = 0
+        self.stores = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def new_search(self):
+        """ Age existing entries, called once per turn.
+        """
+        self.generation += 1
+
+    def clear(self):
+        self.slots = [None] * len(self.slots)
+        self.generation = 0
+
+    def probe(self, key):
+        """ (depth, flag, score, move) stored for key, or None.
+        """
+        self.probes += 1
+        entry = self.slots[key & self.mask]
+        if entry is None or entry[0] != key:
+            return None
+        self.hits += 1
+        return entry[1:5]
+
+    def store(self, key, depth, flag, score, move):
+        """ Depth-preferred replacement: keep a deeper entry for another
+            position unless it was left over from an earlier turn.
+        """
+        index = key & self.mask
+        entry = self.slots[index]
+        if (entry is None or entry[0] == key or entry[1] <= depth
+                or entry[5] != self.generation):
+            self.slots[index] = (key, depth, flag, score, move, self.generation)
+            self.stores += 1
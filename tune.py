@@ -0,0 +1,257 @@
+""" Fitting the evaluation weights to recorded games with NumPy.
+
+    python tune.py games.bin --output weights.json --validate 100 --processes 4
+
+    Every position of the recorded games (see records.py) becomes one row
+    of the features PatternEvaluator scores: the configuration of each
+    pattern instance, the stable disc difference and the mobility
+    difference (8x8 only). The label is the game's final disc
+    differential, or with --label search the value of a --depth
+    alpha-beta search of the position, both from black's point of view.
+    Pattern scores and the stability and mobility weights are fitted to
+    the labels by least squares, starting from the current weights (the
+    defaults or --weights). Configurations seen in few positions stay
+    close to where they started, see --prior. The weights are one set
+    for the whole game, as PatternEvaluator has no phases. Every tenth
+    game is held out to report the error on positions the fit didn't
+    see.
+
+    --validate N plays N games of the fitted weights against the
+    starting ones over a process pool, from random openings with colours
+    swapped in pairs, and the weights file is only written if the fitted
+    weights score at least half the points. Play with them using
+    runner.py --weights weights.json.
+"""
+import argparse
+import multiprocessing
+import random
+
+import numpy as np
+
+from reversi import BLACK, WHITE, opponent
+from bitboard import BitReversi
+from agents import AlphaBetaAgent
+from records import read_games, make_game, analyze
+from patterns import PatternEvaluator, load_weights, save_weights
+from match import play_match
+
+HOLD_OUT = 10
+
+
+def game_rows(game, evaluator, moves):
+    """ ([(ply, player to move, empty squares, instance indices, stable
+        difference, mobility difference)], final disc differential) for
+        one recorded game, the features of each position kept up to date
+        move by move.
+    """
+    state = game.initial_state()
+    evaluator.reset(game, state)
+    mobility = (game.w, game.h) == (8, 8)
+    rows = []
+    for ply, move in enumerate(moves):
+        black, white = evaluator.analyzer.count(evaluator.masks[1], evaluator.masks[2])
+        rows.append((ply, state.player, game.empty_count(state), list(evaluator.indices),
+                     black - white, evaluator.mobility_difference() if mobility else 0))
+        record = game.apply(state, move)
+        square, flipped = game.changes(record)
+        evaluator.update(record[2], square, flipped)
+    return rows, game.score_player(state, BLACK) - game.score_player(state, WHITE)
+
+
+def extract(path, w, h, values=None):
+    """ (game numbers, instance indices, stable differences, mobility
+        differences, labels) as arrays for every w x h position. Labels
+        are final results, or values[number, ply] for the player to move
+        when given.
+    """
+    game = make_game(w, h, bitboard=True)
+    evaluator = PatternEvaluator(w, h)
+    numbers, indices, stable, mobile, labels = [], [], [], [], []
+    for number, (gw, gh, moves) in enumerate(read_games(path)):
+        if (gw, gh) != (w, h):
+            continue
+        rows, result = game_rows(game, evaluator, moves)
+        for ply, player, _, instance_indices, difference, moves_difference in rows:
+            if values is None:
+                label = result
+            else:
+                label = values.get((number, ply))
+                if label is None:
+                    continue
+                if player == WHITE:
+                    label = -label
+            numbers.append(number)
+            indices.append(instance_indices)
+            stable.append(difference)
+            mobile.append(moves_difference)
+            labels.append(label)
+    return (np.array(numbers), np.array(indices, dtype=np.int64).reshape(len(labels), -1),
+            np.array(stable, dtype=np.float64), np.array(mobile, dtype=np.float64),
+            np.array(labels, dtype=np.float64))
+
+
+def search_values(path, depth, processes):
+    """ {(game number, ply): value for the player to move} from an
+        alpha-beta search of every recorded position.
+    """
+    options = {"depth": depth, "timeout": 3600, "bitboard": True}
+    return dict(((number, ply), value)
+                for number, ply, _, _, value in analyze(path, "alphabeta", options, processes)
+                if value is not None)
+
+
+class Model:
+    """ The evaluator's weights as one vector: every kind's table end to
+        end, instance indices offset into it, then the stability and
+        mobility weights on their own.
+    """
+
+    def __init__(self, w, h, tables=None):
+        evaluator = PatternEvaluator(w, h, tables)
+        self.offsets = {}
+        self.sizes = {}
+        params = []
+        for (kind, _), table in zip(evaluator.instances, evaluator.tables):
+            if kind not in self.offsets:
+                self.offsets[kind] = len(params)
+                self.sizes[kind] = len(table)
+                params.extend(table)
+        self.params = np.array(params, dtype=np.float64)
+        self.stability = evaluator.stability
+        self.mobility = evaluator.mobility
+        self.instance_offsets = np.array([self.offsets[kind] for kind, _ in evaluator.instances])
+
+    def columns(self, indices):
+        """ Instance indices as positions in params.
+        """
+        return indices + self.instance_offsets
+
+    def predict(self, columns, stable, mobile):
+        return self.params[columns].sum(axis=1) + self.stability * stable + self.mobility * mobile
+
+    def fit(self, columns, stable, mobile, labels, iterations=100, prior=10.0, verbose=None):
+        """ Least squares by damped Jacobi iterations, all rows at once:
+            each parameter moves by the mean residual of the rows using
+            it, shrunk by prior rows' worth of weight on its current
+            value.
+        """
+        instances = columns.shape[1]
+        flat = columns.ravel()
+        counts = np.bincount(flat, minlength=len(self.params))
+        stable_norm = (stable * stable).sum() + prior
+        mobile_norm = (mobile * mobile).sum() + prior
+        for iteration in range(iterations):
+            residual = labels - self.predict(columns, stable, mobile)
+            totals = np.bincount(flat, weights=np.repeat(residual, instances),
+                                 minlength=len(self.params))
+            self.params += totals / (counts + prior) / instances
+            self.stability += (residual * stable).sum() / stable_norm / instances
+            self.mobility += (residual * mobile).sum() / mobile_norm / instances
+            if verbose:
+                verbose(iteration, rms(residual))
+
+    def tables(self):
+        """ {kind: scores, "stability": weight, "mobility": weight} for
+            patterns.save_weights.
+        """
+        tables = {}
+        for kind, start in self.offsets.items():
+            scores = self.params[start:start + self.sizes[kind]]
+            tables[kind] = [round(score, 3) for score in scores.tolist()]
+        tables["stability"] = round(float(self.stability), 3)
+        tables["mobility"] = round(float(self.mobility), 3)
+        return tables
+
+
+def rms(residual):
+    return float(np.sqrt((residual * residual).mean())) if len(residual) else 0.0
+
+
+def play_validation(task):
+    """ 1, 0.5 or 0 points for the candidate weights in one game.
+    """
+    index, candidate, baseline, depth, plies, seed = task
+    game = BitReversi()
+    rng = random.Random(seed + index // 2)
+    state = game.initial_state()
+    for _ in range(plies):
+        state = game.make_move(state, rng.choice(game.legal_moves(state) or ["pass"]))
+    new = AlphaBetaAgent(depth, weights=candidate)
+    old = AlphaBetaAgent(depth, weights=baseline)
+    agents = [new, old] if index % 2 == 0 else [old, new]
+    colour = state.player if index % 2 == 0 else opponent(state.player)
+    final, _, _ = play_match(game, agents, 3600, state=state)
+    difference = game.score_player(final, colour) - game.score_player(final, opponent(colour))
+    return 1.0 if difference > 0 else 0.5 if difference == 0 else 0.0
+
+
+def validate(candidate, baseline, games, depth, plies=6, seed=0, processes=None):
+    """ Candidate's share of the points in games 8x8 games against
+        baseline (tables, None for the defaults), played over a pool.
+    """
+    tasks = [(index, candidate, baseline, depth, plies, seed) for index in range(games)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        points = pool.map(play_validation, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    return sum(points) / len(points)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit Reversi evaluation weights to recorded games.")
+    parser.add_argument("path", help="records file, .bin for binary")
+    parser.add_argument("--output", help="weights file to write", default="weights.json")
+    parser.add_argument("--weights", help="start from these weights, built-in weights by default", default=None)
+    parser.add_argument("--size", help="board size of the games to fit", default="8x8")
+    parser.add_argument("--label", choices=["result", "search"], default="result")
+    parser.add_argument("--depth", help="search depth for --label search and --validate", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--prior", help="positions' worth of weight on the starting scores", type=float, default=10.0)
+    parser.add_argument("--validate", help="self-play N games against the starting weights", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--verbose", help="print the error every iteration", action="store_true")
+    args = parser.parse_args()
+
+    w, h = map(int, args.size.split("x"))
+    baseline = load_weights(args.weights) if args.weights else None
+    values = search_values(args.path, args.depth, args.processes) if args.label == "search" else None
+    numbers, indices, stable, mobile, labels = extract(args.path, w, h, values)
+    if not len(labels):
+        print("no {} positions in {}".format(args.size, args.path))
+        return
+
+    model = Model(w, h, baseline)
+    columns = model.columns(indices)
+    train = numbers % HOLD_OUT != HOLD_OUT - 1
+    test = ~train
+    if test.any():
+        before = rms(labels[test] - model.predict(columns[test], stable[test], mobile[test]))
+
+    def progress(iteration, error):
+        print("iteration {}: training error {:0.3f}".format(iteration + 1, error))
+
+    model.fit(columns[train], stable[train], mobile[train], labels[train], args.iterations, args.prior,
+              progress if args.verbose else None)
+    if test.any():
+        after = rms(labels[test] - model.predict(columns[test], stable[test], mobile[test]))
+        print("{} positions, held out error {:0.3f} before, {:0.3f} after, stability weight {:0.2f}, "
+              "mobility weight {:0.2f}".format(len(labels), before, after, model.stability, model.mobility))
+    else:
+        print("{} positions, none held out (fewer than {} games), stability weight {:0.2f}, "
+              "mobility weight {:0.2f}".format(len(labels), HOLD_OUT, model.stability, model.mobility))
+
+    tables = model.tables()
+    if args.validate:
+        score = validate(tables, baseline, args.validate, args.depth, processes=args.processes)
+        print("fitted weights scored {:0.1f}% in {} games".format(100.0 * score, args.validate))
+        if score < 0.5:
+            print("not writing {}".format(args.output))
+            return
+    save_weights(args.output, tables)
+    print("wrote {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()